@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends, status, FastAPI, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from typing import Optional
 import uvicorn
 
@@ -216,7 +216,8 @@ async def get_current_user_from_token(credentials: HTTPAuthorizationCredentials
 auth_app = FastAPI(
     title="Authentication API",
     description="Authentication service for email provider application",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Include the auth router
@@ -236,4 +237,4 @@ if __name__ == "__main__":
     print("Email Confirmation at: http://localhost:8001/auth/confirm")
     print("Press Ctrl+C to stop the server")
     print("-" * 50)
-    uvicorn.run(auth_app, host="0.0.0.0", port=8001)
+    uvicorn.run(auth_app, host="0.0.0.0", port=8001, loop="uvloop", http="httptools")
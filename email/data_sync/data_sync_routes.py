@@ -13,7 +13,7 @@ try:
     from .models import EmailSyncRequest, EmailSyncResult, EmailMessage, EmailAccount
     from .email_sync_service import EmailSyncService
     from .gmail_service import GmailService
-    from .outlook_service import OutlookService
+    from .outlook_service import OutlookService, close_aiohttp_session
     from common.supabase_client import get_supabase_client
 except Exception as e:
     import sys
@@ -22,7 +22,7 @@ except Exception as e:
     from models import EmailSyncRequest, EmailSyncResult, EmailMessage, EmailAccount
     from email_sync_service import EmailSyncService
     from gmail_service import GmailService
-    from outlook_service import OutlookService
+    from outlook_service import OutlookService, close_aiohttp_session
     from common.supabase_client import get_supabase_client
 
 # Import auth dependencies
@@ -36,6 +36,7 @@ logger = logging.getLogger(__name__)
 
 # Create router
 data_sync_router = APIRouter(prefix="/data-sync", tags=["Email Data Sync"])
+data_sync_router.add_event_handler("shutdown", close_aiohttp_session)
 
 # Initialize services
 supabase = get_supabase_client().get_admin_client()
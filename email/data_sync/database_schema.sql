@@ -79,6 +79,17 @@ CREATE TABLE IF NOT EXISTS email.email_message (
     updated_at                  TIMESTAMP WITH TIME ZONE DEFAULT now()
 );
 
+-- Email Sync State table
+-- Stores the Outlook delta link each account folder resumes syncing from
+-- (for folder 'provider_messages', the provider cursor: a Graph delta link or Gmail history ID)
+CREATE TABLE IF NOT EXISTS email.email_sync_state (
+    account_id                  UUID REFERENCES email_provider.email_accounts(id) ON DELETE CASCADE,
+    folder                      TEXT NOT NULL,
+    delta_link                  TEXT NOT NULL,
+    updated_at                  TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (account_id, folder)
+);
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_email_lead_user_id ON email.email_lead(user_id);
 CREATE INDEX IF NOT EXISTS idx_email_lead_created_at ON email.email_lead(created_at);
@@ -111,6 +122,7 @@ CREATE TRIGGER update_email_message_updated_at
 -- Enable Row Level Security (RLS)
 ALTER TABLE email.email_lead ENABLE ROW LEVEL SECURITY;
 ALTER TABLE email.email_message ENABLE ROW LEVEL SECURITY;
+ALTER TABLE email.email_sync_state ENABLE ROW LEVEL SECURITY;
 
 -- Create RLS policies
 -- Users can only access their own data
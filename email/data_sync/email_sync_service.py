@@ -3,6 +3,7 @@ Unified email sync service for Gmail and Outlook.
 Handles email synchronization from multiple providers to the database.
 """
 
+import asyncio
 import logging
 from typing import List, Optional, Dict, Any
 from datetime import datetime
@@ -13,7 +14,7 @@ try:
         EmailAccount, EmailSyncRequest, EmailSyncResult, DataSyncResponse
     )
     from .gmail_service import GmailService
-    from .outlook_service import OutlookService
+    from .outlook_service import OutlookService, AsyncOutlookService, ALL_FOLDERS
     from common.supabase_client import get_supabase_client
 except Exception as e:
     print("Error in email_sync_service.py")
@@ -26,10 +27,13 @@ except Exception as e:
         EmailAccount, EmailSyncRequest, EmailSyncResult, DataSyncResponse
     )
     from gmail_service import GmailService
-    from outlook_service import OutlookService
+    from outlook_service import OutlookService, AsyncOutlookService, ALL_FOLDERS
     from common.supabase_client import get_supabase_client
 logger = logging.getLogger(__name__)
 
+# Maximum accounts of one user synced at the same time
+ACCOUNT_SYNC_CONCURRENCY = 4
+
 
 class EmailSyncService:
     """Unified service for syncing emails from multiple providers."""
@@ -38,11 +42,11 @@ class EmailSyncService:
         """Initialize the email sync service."""
         self.supabase = get_supabase_client().get_admin_client()
         self.gmail_service = GmailService()
-        self.outlook_service = OutlookService()
         self.schema = "email"
         self.message_table = "email_message"
         self.account_table = "email_accounts"
         self.lead_table = "email_lead"
+        self.sync_state_table = "email_sync_state"
     
     async def get_user_email_accounts(self, user_id: str) -> List[EmailAccount]:
         """Get all email accounts for a user."""
@@ -97,25 +101,34 @@ class EmailSyncService:
             total_messages_updated = 0
             all_errors = []
             
-            # Sync each account
-            for account in accounts:
-                try:
-                    result = await self.sync_emails_for_account(
+            # Sync accounts concurrently; provider calls overlap while others wait on I/O
+            semaphore = asyncio.Semaphore(ACCOUNT_SYNC_CONCURRENCY)
+            
+            async def sync_account(account: EmailAccount) -> EmailSyncResult:
+                async with semaphore:
+                    return await self.sync_emails_for_account(
                         account, 
                         sync_request.user_id,
                         sync_request.max_messages,
                         sync_request.folder
                     )
-                    
-                    total_messages_synced += result.messages_synced
-                    total_messages_created += result.messages_created
-                    total_messages_updated += result.messages_updated
-                    all_errors.extend(result.errors)
-                    
-                except Exception as e:
-                    error_msg = f"Error syncing account {account.email}: {str(e)}"
+            
+            results = await asyncio.gather(
+                *(sync_account(account) for account in accounts),
+                return_exceptions=True
+            )
+            
+            for account, result in zip(accounts, results):
+                if isinstance(result, Exception):
+                    error_msg = f"Error syncing account {account.email}: {str(result)}"
                     logger.error(error_msg)
                     all_errors.append(error_msg)
+                    continue
+                
+                total_messages_synced += result.messages_synced
+                total_messages_created += result.messages_created
+                total_messages_updated += result.messages_updated
+                all_errors.extend(result.errors)
             
             return EmailSyncResult(
                 success=len(all_errors) == 0,
@@ -137,15 +150,33 @@ class EmailSyncService:
                                     max_messages: int = 100, folder: Optional[str] = None) -> EmailSyncResult:
         """Sync emails for a specific account."""
         try:
+            # Outlook syncs of a single folder resume from a stored delta link
+            delta_folder = None
+            delta_link = None
+            removed_ids: List[str] = []
+            
             # Get emails from provider
+            # Tokens (and Outlook's folder cache) live on the service instance and
+            # accounts sync concurrently, so each sync gets its own
             if account.provider.lower() == 'google':
-                email_messages = self.gmail_service.get_message_for_database(
-                    account, user_id, max_messages, folder
-                )    
-            elif account.provider.lower() == 'outlook':
-                email_messages = self.outlook_service.get_message_for_database(
+                # The Gmail client is blocking, so it runs in a worker thread
+                email_messages = await asyncio.to_thread(
+                    GmailService().get_message_for_database,
                     account, user_id, max_messages, folder
                 )
+            elif account.provider.lower() == 'outlook':
+                if folder == ALL_FOLDERS:
+                    email_messages = await AsyncOutlookService().aget_message_for_database(
+                        account, user_id, max_messages, folder
+                    )
+                else:
+                    # Delta rounds run on the blocking client in a worker thread
+                    delta_folder = folder or 'inbox'
+                    stored_link = await self._get_delta_link(account.id, delta_folder)
+                    email_messages, removed_ids, delta_link = await asyncio.to_thread(
+                        OutlookService().get_message_changes_for_database,
+                        account, delta_folder, stored_link, max_messages
+                    )
             else:
                 return EmailSyncResult(
                     success=False,
@@ -153,7 +184,19 @@ class EmailSyncService:
                     errors=[f"Unsupported provider: {account.provider}"]
                 )
             
+            # Messages deleted or moved out of the folder no longer belong in it
+            if removed_ids:
+                delete_result = await self._delete_messages(removed_ids, user_id)
+                if not delete_result.success:
+                    return EmailSyncResult(
+                        success=False,
+                        messages_synced=0,
+                        errors=delete_result.errors or [delete_result.message]
+                    )
+            
             if not email_messages:
+                if delta_link:
+                    await self._save_delta_link(account.id, delta_folder, delta_link)
                 return EmailSyncResult(
                     success=True,
                     messages_synced=0,
@@ -170,7 +213,12 @@ class EmailSyncService:
                     errors=lead_result.errors
                 )
             # Sync to database
-            return await self._sync_messages_to_database(email_messages, user_id)
+            result = await self._sync_messages_to_database(email_messages, user_id)
+            
+            # Only advance the delta link once the changes are stored
+            if delta_link and result.success:
+                await self._save_delta_link(account.id, delta_folder, delta_link)
+            return result
             
         except Exception as e:
             logger.error(f"Error syncing emails for account {account.email}: {str(e)}")
@@ -353,6 +401,36 @@ class EmailSyncService:
                 errors=[str(e)]
             )
     
+    async def _get_delta_link(self, account_id: str, folder: str) -> Optional[str]:
+        """Get the stored delta link of an account folder."""
+        try:
+            result = self.supabase.schema(self.schema).from_(self.sync_state_table)\
+                .select("delta_link")\
+                .eq("account_id", account_id)\
+                .eq("folder", folder)\
+                .execute()
+            
+            if result.data:
+                return result.data[0].get("delta_link")
+            return None
+            
+        except Exception as e:
+            logger.error(f"Error getting delta link for account {account_id}: {str(e)}")
+            return None
+    
+    async def _save_delta_link(self, account_id: str, folder: str, delta_link: str) -> None:
+        """Store the delta link of an account folder."""
+        try:
+            self.supabase.schema(self.schema).from_(self.sync_state_table).upsert({
+                "account_id": account_id,
+                "folder": folder,
+                "delta_link": delta_link,
+                "updated_at": datetime.utcnow().isoformat()
+            }).execute()
+            
+        except Exception as e:
+            logger.error(f"Error saving delta link for account {account_id}: {str(e)}")
+    
     async def _get_message_by_id(self, message_id: str, user_id: str) -> Optional[EmailMessage]:
         """Get a message by ID."""
         try:
@@ -370,6 +448,28 @@ class EmailSyncService:
             logger.error(f"Error getting message {message_id}: {str(e)}")
             return None
     
+    async def _delete_messages(self, message_ids: List[str], user_id: str) -> DataSyncResponse:
+        """Delete messages that were removed from the mailbox."""
+        try:
+            self.supabase.schema(self.schema).from_(self.message_table)\
+                .delete()\
+                .eq("user_id", user_id)\
+                .in_("message_id", message_ids)\
+                .execute()
+            
+            return DataSyncResponse(
+                success=True,
+                message=f"Deleted {len(message_ids)} removed messages"
+            )
+            
+        except Exception as e:
+            logger.error(f"Error deleting removed messages: {str(e)}")
+            return DataSyncResponse(
+                success=False,
+                message="Failed to delete removed messages",
+                errors=[str(e)]
+            )
+    
     async def _create_message(self, email_msg: EmailMessageCreate, user_id: str) -> DataSyncResponse:
         """Create a new email message."""
         try:
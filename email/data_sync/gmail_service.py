@@ -6,18 +6,21 @@ Handles Gmail API authentication and email data extraction.
 import logging
 import base64
 import json
-from typing import List, Optional, Dict, Any, Tuple
-from datetime import datetime, timezone
+from typing import List, Optional, Dict, Any, Tuple, Union
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import re
 import os
+import time
 from dotenv import load_dotenv
 
+import lxml.html
+from lxml import etree
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
 try:
     from .models import EmailMessageCreate, EmailAccount, EmailLeadDisplay
@@ -34,10 +37,29 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.readonly'
 ]
 
+# Headers extracted from each message payload
+WANTED_HEADERS = ('subject', 'from', 'to', 'date')
+WANTED_HEADERS_SET = frozenset(WANTED_HEADERS)
+
+# Message bodies are decoded as UTF-8, matching the plain-text path
+HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+WHITESPACE_RE = re.compile(r'\s+')
+
 load_dotenv()
+
+
+def _decode_b64url(data: str) -> bytes:
+    """Decode a base64url body part to raw bytes."""
+    return base64.urlsafe_b64decode(data)
+
+
 class GmailService:
     """Service for interacting with Gmail API."""
     
+    # Raw bundled discovery document, read once. Built services wrap an httplib2
+    # client that is not thread-safe, so each instance builds its own from this.
+    _DISCOVERY_DOC: Optional[str] = None
+    
     def __init__(self, credentials_path: Optional[str] = None):
         """Initialize Gmail service."""
         self.credentials_path = credentials_path
@@ -54,12 +76,15 @@ class GmailService:
                 client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),  # Will be set from token
                 scopes=SCOPES
             )
+            if GmailService._DISCOVERY_DOC is None:
+                GmailService._DISCOVERY_DOC = get_static_doc('gmail', 'v1')
+            service = build_from_document(GmailService._DISCOVERY_DOC, credentials=creds)
             
             # Refresh token if needed
             if creds.expired and creds.refresh_token:
                 creds.refresh(Request())
             
-            self.service = build('gmail', 'v1', credentials=creds)
+            self.service = service
             return True
             
         except Exception as e:
@@ -96,39 +121,46 @@ class GmailService:
             if not self.service:
                 raise Exception("Gmail service not authenticated")
             
-            # Build query
-            gmail_query = query
-            if folder_id and folder_id != 'ALL':
-                gmail_query = f"in:{folder_id} {query}".strip()
-            print(f"gmail_query gmail_query gmail_query {gmail_query}")
-            
-            # Get message list
-            results = self.service.users().messages().list(
-                userId='me',
-                q=gmail_query,
-                maxResults=max_results,
-                includeSpamTrash=include_spam_trash
-            ).execute()
-            print(f"results results results {len(results)}")
-            messages = results.get('messages', [])
-            detailed_messages = []
-            
-            # Get detailed message data
-            for message in messages:
-                try:
-                    msg_detail = self._get_message_detail(message['id'])
-                    if msg_detail:
-                        detailed_messages.append(msg_detail)
-                except Exception as e:
-                    logger.warning(f"Error getting message detail for {message['id']}: {str(e)}")
-                    continue
-            
-            return detailed_messages
+            message_ids = self._list_message_ids(folder_id, max_results, query, include_spam_trash)
+            return self._get_message_details(message_ids)
             
         except HttpError as e:
             logger.error(f"Error getting Gmail messages: {str(e)}")
             return []
     
+    def _list_message_ids(self, folder_id: str, max_results: int, query: str = '',
+                          include_spam_trash: bool = False) -> List[str]:
+        """List message IDs matching a folder and query."""
+        # Build query
+        gmail_query = query
+        if folder_id and folder_id != 'ALL':
+            gmail_query = f"in:{folder_id} {query}".strip()
+        logger.debug(f"Listing Gmail messages with query {gmail_query!r}")
+        
+        # Get message list
+        results = self.service.users().messages().list(
+            userId='me',
+            q=gmail_query,
+            maxResults=max_results,
+            includeSpamTrash=include_spam_trash
+        ).execute()
+        return [message['id'] for message in results.get('messages', [])]
+    
+    def _get_message_details(self, message_ids: List[str]) -> List[Dict[str, Any]]:
+        """Get detailed message data for a list of message IDs."""
+        detailed_messages = []
+        
+        for message_id in message_ids:
+            try:
+                msg_detail = self._get_message_detail(message_id)
+                if msg_detail:
+                    detailed_messages.append(msg_detail)
+            except Exception as e:
+                logger.warning(f"Error getting message detail for {message_id}: {str(e)}")
+                continue
+        
+        return detailed_messages
+    
     def _get_message_detail(self, message_id: str) -> Optional[Dict[str, Any]]:
         """Get detailed message information."""
         try:
@@ -138,55 +170,52 @@ class GmailService:
                 format='full'
             ).execute()
             
-            payload = message['payload']
-            headers = payload.get('headers', [])
-            
-            # Extract headers
-            header_dict = {header['name'].lower(): header['value'] for header in headers}
-            
-            # Extract basic info
-            subject = header_dict.get('subject', '')
-            sender = header_dict.get('from', '')
-            receiver = header_dict.get('to', '')
-            date_str = header_dict.get('date', '')
-            
-            # Parse date
-            internal_date = message.get('internalDate')
-            if internal_date:
-                internal_date = int(internal_date)
-            else:
-                internal_date = int(datetime.now(timezone.utc).timestamp() * 1000)
-            
-            # Extract body
-            body = self._extract_body(payload)
-            
-            # Extract folder (label)
-            labels = message.get('labelIds', [])
-            folder = self._get_primary_folder(labels)
-            
-            # Check if read
-            is_read = 'UNREAD' not in labels
-            print(f"message.get('threadId'),message.get('threadId'),message.get('threadId'), {message.get('threadId')}")
-            return {
-                'message_id': message_id,
-                'subject': subject,
-                'sender': sender,
-                'receiver': receiver,
-                'body': body,
-                'is_read': is_read,
-                'folder': folder,
-                'internal_date': internal_date,
-                'raw_data': message,
-                'labels': labels,
-                'lead_id': message.get('threadId'),
-                'summary': message.get('snippet'),
-                'history_id': message.get('historyId')
-            }
+            return self._parse_message(message)
             
         except Exception as e:
             logger.error(f"Error getting message detail for {message_id}: {str(e)}")
             return None
     
+    def _parse_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert a full-format Gmail message resource to a message dict."""
+        # Full-format resources always carry id and payload
+        payload = message['payload']
+        get = message.get
+        
+        # Extract only the headers we need, stopping once all are found
+        header_dict = {}
+        for header in payload.get('headers', ()):
+            name = header['name']
+            if len(name) < 8:
+                key = name.lower()
+                if key in WANTED_HEADERS_SET:
+                    header_dict[key] = header['value']
+                    if len(header_dict) == len(WANTED_HEADERS):
+                        break
+        
+        # Parse date
+        internal_date = get('internalDate')
+        internal_date = int(internal_date) if internal_date else time.time_ns() // 1_000_000
+        
+        # Extract folder (label) and read state
+        labels = get('labelIds', [])
+        
+        return {
+            'message_id': message['id'],
+            'subject': header_dict.get('subject', ''),
+            'sender': header_dict.get('from', ''),
+            'receiver': header_dict.get('to', ''),
+            'body': self._extract_body(payload),
+            'is_read': 'UNREAD' not in labels,
+            'folder': self._get_primary_folder(labels),
+            'internal_date': internal_date,
+            'raw_data': message,
+            'labels': labels,
+            'lead_id': get('threadId'),
+            'summary': get('snippet'),
+            'history_id': get('historyId')
+        }
+    
     def _extract_body(self, payload: Dict[str, Any]) -> str:
         """Extract email body from payload."""
         body = ""
@@ -197,41 +226,36 @@ class GmailService:
                 if part['mimeType'] == 'text/plain':
                     data = part['body'].get('data')
                     if data:
-                        body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
+                        body = _decode_b64url(data).decode('utf-8', errors='ignore')
                         break
                 elif part['mimeType'] == 'text/html' and not body:
                     data = part['body'].get('data')
                     if data:
-                        html_body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-                        # Simple HTML to text conversion
-                        body = self._html_to_text(html_body)
+                        # Parse the decoded bytes directly, without an intermediate str
+                        body = self._html_to_text(_decode_b64url(data))
         else:
             # Single part message
             if payload['mimeType'] == 'text/plain':
                 data = payload['body'].get('data')
                 if data:
-                    body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
+                    body = _decode_b64url(data).decode('utf-8', errors='ignore')
             elif payload['mimeType'] == 'text/html':
                 data = payload['body'].get('data')
                 if data:
-                    html_body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-                    body = self._html_to_text(html_body)
+                    body = self._html_to_text(_decode_b64url(data))
         
         return body
     
-    def _html_to_text(self, html: str) -> str:
-        """Simple HTML to text conversion."""
-        # Remove HTML tags
-        text = re.sub(r'<[^>]+>', '', html)
-        # Decode HTML entities
-        text = text.replace('&nbsp;', ' ')
-        text = text.replace('&amp;', '&')
-        text = text.replace('&lt;', '<')
-        text = text.replace('&gt;', '>')
-        text = text.replace('&quot;', '"')
-        # Clean up whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
-        return text
+    def _html_to_text(self, html: Union[bytes, str]) -> str:
+        """Convert HTML (raw bytes or text) to plain text."""
+        try:
+            tree = lxml.html.document_fromstring(html, parser=HTML_PARSER)
+        except (etree.ParserError, ValueError):
+            return ''
+        # Drop non-visible content before extracting text
+        for element in tree.iter('script', 'style'):
+            element.drop_tree()
+        return WHITESPACE_RE.sub(' ', tree.text_content()).strip()
     
     def _get_primary_folder(self, labels: List[str]) -> str:
         """Get primary folder from labels."""
@@ -250,12 +274,8 @@ class GmailService:
             if label in folder_priority:
                 return folder_priority[label]
         
-        # Check for user labels
-        user_labels = [label for label in labels if not label.startswith('Label_')]
-        if user_labels:
-            return user_labels[0]
-        
-        return 'inbox'  # Default
+        # First user label, defaulting to inbox
+        return next((label for label in labels if not label.startswith('Label_')), 'inbox')
     
     def get_message_for_database(self, account: EmailAccount, user_id: str, 
                                max_messages: int = 100, folder: Optional[str] = None) -> List[EmailMessageCreate]:
@@ -264,13 +284,13 @@ class GmailService:
             # Authenticate
             if not self.authenticate_with_tokens(account.access_token, account.refresh_token):
                 raise Exception("Failed to authenticate with Gmail")
-            print(f"get_messages get_messages get_messages  folder {folder}, max_messages {max_messages}")
+            logger.debug(f"Getting Gmail messages for folder {folder}, max_messages {max_messages}")
             # Get messages
             messages = self.get_messages(
                 folder_id=folder or 'INBOX',
                 max_results=max_messages
             )
-            print(f"messages messages messages messages messages {len(messages)}")
+            logger.debug(f"Fetched {len(messages)} Gmail messages")
             # Convert to EmailMessageCreate objects
             email_messages = []
             for msg in messages:
@@ -351,11 +371,14 @@ class GmailService:
                 format='full'
             ).execute()
             
+            # The thread is fetched in full format, so parse its messages directly
             messages = []
             for message in thread.get('messages', []):
-                msg_detail = self._get_message_detail(message['id'])
-                if msg_detail:
-                    messages.append(msg_detail)
+                try:
+                    messages.append(self._parse_message(message))
+                except Exception as e:
+                    logger.warning(f"Error parsing message {message.get('id', 'unknown')}: {str(e)}")
+                    continue
             
             return messages
             
@@ -6,11 +6,24 @@ Handles Microsoft Graph API authentication and email data extraction.
 import logging
 import json
 import re
-from typing import List, Optional, Dict, Any
+import time
+from typing import List, Optional, Dict, Any, Tuple, Iterable, Iterator, Callable
 from datetime import datetime, timezone
+import asyncio
+import base64
+import itertools
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import aiohttp
+import ciso8601
+import lxml.html
+import orjson
 import requests
 import os
 from dotenv import load_dotenv
+from lxml import etree
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
@@ -25,36 +38,199 @@ except Exception as e:
     
 logger = logging.getLogger(__name__)
 
+# Shared aiohttp session for AsyncOutlookService, created on first use
+_aiohttp_session: Optional[aiohttp.ClientSession] = None
+
+# Runs background token refreshes for all service instances
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='outlook-token-refresh')
+# In-flight refreshes keyed by account, so instances syncing the same account
+# join one refresh instead of each spending the refresh token
+_refresh_lock = threading.Lock()
+_refresh_futures: Dict[Any, Future] = {}
+
+# Token states returned by OutlookService._token_state
+TOKEN_FRESH = 'fresh'
+TOKEN_STALE = 'stale'
+TOKEN_EXPIRED = 'expired'
+
 # Microsoft Graph API endpoints
 GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
+GRAPH_BATCH_URL = f"{GRAPH_BASE_URL}/$batch"
+GRAPH_BATCH_LIMIT = 20  # Maximum sub-requests per JSON batch
+GRAPH_BATCH_MAX_RETRIES = 3
+# Retry policy shared by the requests session and the aiohttp client
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 0.25
+RETRY_BACKOFF_MAX = 8
+MESSAGES_PAGE_SIZE = 100
+PROCESS_MAX_WORKERS = 8  # Threads converting messages (HTML parsing, folder lookups)
+# Message fields listed for every message; the full body is added on request
+MESSAGE_SELECT = 'id,subject,from,toRecipients,bodyPreview,receivedDateTime,isRead,parentFolderId,conversationId,internetMessageId'
 TOKEN_URL = "https://login.microsoftonline.com/common/oauth2/v2.0/token"
+# Refresh this many seconds before the access token's exp claim
+TOKEN_EXPIRY_SKEW = 30
+# Within this many seconds of expiry the token is refreshed in the background
+TOKEN_STALE_WINDOW = 300
+# How long a /me probe vouches for an opaque (non-JWT) access token
+OPAQUE_TOKEN_TTL = 300
+# Seconds to wait after a failed token refresh before trying again
+REFRESH_RETRY_INTERVAL = 60
+# Seconds a refreshed token is offered to other instances for the same account
+REFRESHED_TOKEN_TTL = 3600
 GRAPH_SCOPES = [
     "https://graph.microsoft.com/Mail.Read",
     "https://graph.microsoft.com/Mail.Send",
     "https://graph.microsoft.com/User.Read"
 ]
 
+# Graph bodies arrive as str; they are re-encoded and parsed as UTF-8 so an XML
+# encoding declaration in XHTML mail does not make lxml reject them
+HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+WHITESPACE_RE = re.compile(r'\s+')
+# Single-keyword queries that can go to Graph's search index via $search
+SIMPLE_QUERY_RE = re.compile(r'^[\w@.\-]+$')
+
+# Asks Graph to convert message bodies to plain text server-side
+PREFER_TEXT_BODY = 'outlook.body-content-type="text"'
+
+# Attachment metadata inlined by include_attachments; contentBytes stays out
+ATTACHMENTS_EXPAND = 'attachments($select=id,name,contentType,size,isInline)'
+
+FOLDERS_PAGE_SIZE = 250
+FOLDERS_CACHE_TTL = 300  # Seconds a listed mailbox's folders are reused
+SHARED_CACHE_SIZE = 1024  # Entries kept in each cache shared across instances
+UNREAD_COUNT_TTL = 60  # Seconds an unread count is reused by polling callers
+# get_message_for_database folder value that syncs every folder
+ALL_FOLDERS = 'all'
+
+# Common Outlook folder mappings, used when a folder is not in the folder cache
+FOLDER_MAPPINGS = {
+    'inbox': 'inbox',
+    'drafts': 'drafts',
+    'sentitems': 'sent',
+    'deleteditems': 'deleted',
+    'junkemail': 'junk',
+    'outbox': 'outbox'
+}
+
+
+def _json(response: requests.Response) -> Any:
+    """Decode a Graph API response body with orjson."""
+    return orjson.loads(response.content)
+
+
+def _token_expiry(access_token: str) -> Optional[float]:
+    """Read the exp claim of a JWT access token, or None if it is opaque."""
+    try:
+        payload = access_token.split('.')[1]
+        claims = orjson.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except Exception:
+        return None
+
+
+def _retry_after(value: Optional[str], attempt: int) -> float:
+    """Seconds to wait before a retry: Retry-After if sent, else jittered backoff."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return min(RETRY_BACKOFF * (2 ** attempt) + random.uniform(0, RETRY_BACKOFF), RETRY_BACKOFF_MAX)
+
+
+def _addr(recipient: Dict[str, Any]) -> str:
+    """Get the address of a Graph recipient without allocating defaults."""
+    email_address = recipient.get('emailAddress')
+    return email_address.get('address', '') if email_address else ''
+
+
+def _odata_escape(value: str) -> str:
+    """Escape a value for use inside a quoted OData string literal."""
+    return value.replace("'", "''")
+
+
+# Guards the caches shared across instances, which sync threads use concurrently
+_shared_cache_lock = threading.Lock()
+
+
+def _shared_cache_get(cache: OrderedDict, key: Any, ttl: float) -> Any:
+    """Return a shared cache value younger than ttl seconds, or None."""
+    with _shared_cache_lock:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at >= ttl:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return value
+
+
+def _shared_cache_put(cache: OrderedDict, key: Any, value: Any) -> None:
+    """Cache a value, evicting the least recently used entries."""
+    with _shared_cache_lock:
+        cache[key] = (time.monotonic(), value)
+        cache.move_to_end(key)
+        while len(cache) > SHARED_CACHE_SIZE:
+            cache.popitem(last=False)
+
 
 class OutlookService:
     """Service for interacting with Microsoft Graph API (Outlook)."""
     
+    # Request plain-text bodies; the HTML conversion stays as a fallback
+    prefer_text_body = True
+    
+    # Folder listings shared across instances, keyed by account ID
+    _FOLDERS_CACHE: OrderedDict = OrderedDict()
+    # Unread counts keyed by (account ID, folder ID)
+    _UNREAD_CACHE: OrderedDict = OrderedDict()
+    # Latest refreshed (access token, refresh token, expiry) keyed by account
+    _TOKENS_CACHE: OrderedDict = OrderedDict()
+    
     def __init__(self):
         """Initialize Outlook service."""
         self.access_token = None
         self.refresh_token = None
+        # Keys the shared caches; set by the sync entry points, which know the account
+        self.account_id: Optional[str] = None
+        self._token_expiry: Optional[float] = None
+        self._token_checked_until = 0.0
+        # Keys the shared refresh state: the account ID, or the refresh token
+        # the instance was authenticated with when the account is unknown
+        self._token_key: Optional[Any] = None
+        self._refresh_failed_at = 0.0
         self.client_id = os.getenv("OUTLOOK_CLIENT_ID")
         self.client_secret = os.getenv("OUTLOOK_CLIENT_SECRET")
         self.session = self._create_session()
+        # Folder ID -> lowercase display name, loaded on first use
+        self._folder_cache: Optional[Dict[str, str]] = None
+        # Folder ID -> @odata.deltaLink from the last completed delta round
+        self._delta_links: Dict[str, str] = {}
+        # Request headers, rebuilt only when the access token changes
+        self._headers: Dict[str, str] = {}
+        self._headers_token: Optional[Tuple[Optional[str], bool]] = None
     
     def _create_session(self) -> requests.Session:
         """Create a requests session with retry strategy."""
         session = requests.Session()
+        # Short jittered backoff; Graph's Retry-After wins when it is sent
         retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
+            total=RETRY_MAX_ATTEMPTS,
+            backoff_factor=RETRY_BACKOFF,
+            backoff_jitter=RETRY_BACKOFF,
+            backoff_max=RETRY_BACKOFF_MAX,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET', 'PATCH', 'POST', 'PUT', 'DELETE']),
+            respect_retry_after_header=True,
+        )
+        # Size the pool for concurrent Graph calls instead of the default 10
+        adapter = HTTPAdapter(
+            max_retries=retry_strategy,
+            pool_connections=32,
+            pool_maxsize=32
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
         session.mount("http://", adapter)
         session.mount("https://", adapter)
         return session
@@ -65,6 +241,13 @@ class OutlookService:
         try:
             self.access_token = access_token
             self.refresh_token = refresh_token
+            self._token_expiry = _token_expiry(access_token)
+            self._token_checked_until = 0.0
+            self._refresh_failed_at = 0.0
+            self._folder_cache = None
+            self._token_key = self.account_id or refresh_token
+            # Pick up a token another instance already refreshed for this account
+            self._adopt_shared_token()
             
             # Update client credentials if provided
             if client_id:
@@ -80,6 +263,12 @@ class OutlookService:
         """Check if the current access token is expired."""
         if not self.access_token:
             return True
+        
+        # JWT tokens carry their expiry, so no round trip is needed
+        if self._token_expiry is not None:
+            return time.time() + TOKEN_EXPIRY_SKEW >= self._token_expiry
+        if time.time() < self._token_checked_until:
+            return False
             
         try:
             headers = {
@@ -98,6 +287,8 @@ class OutlookService:
                 logger.info("Access token is expired")
                 return True
             elif response.status_code == 200:
+                # Trust the token for a while instead of probing on every call
+                self._token_checked_until = time.time() + OPAQUE_TOKEN_TTL
                 return False
             else:
                 # For other errors, assume token is still valid
@@ -128,13 +319,16 @@ class OutlookService:
             response = self.session.post(token_url, data=data, timeout=30)
             
             if response.status_code == 200:
-                token_data = response.json()
+                token_data = _json(response)
                 new_access_token = token_data.get('access_token')
                 new_refresh_token = token_data.get('refresh_token', self.refresh_token)
                 
                 if new_access_token:
                     self.access_token = new_access_token
                     self.refresh_token = new_refresh_token
+                    self._token_expiry = _token_expiry(new_access_token)
+                    if self._token_expiry is None and token_data.get('expires_in'):
+                        self._token_expiry = time.time() + int(token_data['expires_in'])
                     logger.info("Access token refreshed successfully")
                     return True
                 else:
@@ -149,17 +343,86 @@ class OutlookService:
             return False
     
     def _ensure_valid_token(self) -> bool:
-        """Ensure we have a valid access token, refreshing if necessary."""
+        """Ensure we have a valid access token, refreshing if necessary.
+        
+        A token close to expiry is refreshed in the background while the
+        current one is still used; only an expired token blocks the caller.
+        """
         if not self.access_token:
             logger.error("No access token available")
             return False
-            
-        if self._is_token_expired():
-            logger.info("Token expired, attempting to refresh...")
-            return self._refresh_access_token()
         
+        self._adopt_shared_token()
+        state = self._token_state()
+        if state == TOKEN_FRESH:
+            return True
+        
+        # A refresh that just failed is not retried on every call
+        backing_off = time.time() - self._refresh_failed_at < REFRESH_RETRY_INTERVAL
+        
+        if state == TOKEN_STALE:
+            if not backing_off and self.refresh_token and self.client_id and self.client_secret:
+                self._start_refresh()
+            return True
+        
+        if backing_off:
+            logger.error("Token expired and the last refresh failed; not retrying yet")
+            return False
+        
+        logger.info("Token expired, attempting to refresh...")
+        if not self._start_refresh().result():
+            self._refresh_failed_at = time.time()
+            return False
+        # The refresh may have run on another instance; take its token
+        self._adopt_shared_token()
         return True
     
+    def _token_state(self) -> str:
+        """Classify the current access token as fresh, stale or expired."""
+        if self._is_token_expired():
+            return TOKEN_EXPIRED
+        if self._token_expiry is not None and time.time() + TOKEN_STALE_WINDOW >= self._token_expiry:
+            return TOKEN_STALE
+        return TOKEN_FRESH
+    
+    def _start_refresh(self) -> Future:
+        """Start a token refresh, or join the one in flight for this account."""
+        key = self._token_key or self.refresh_token
+        with _refresh_lock:
+            future = _refresh_futures.get(key)
+            if future is None:
+                future = _refresh_executor.submit(self._run_refresh, key)
+                _refresh_futures[key] = future
+            return future
+    
+    def _run_refresh(self, key: Any) -> bool:
+        """Refresh the access token and share it with other instances."""
+        try:
+            refreshed = self._refresh_access_token()
+            self._refresh_failed_at = 0.0 if refreshed else time.time()
+            if refreshed:
+                _shared_cache_put(self._TOKENS_CACHE, key,
+                                  (self.access_token, self.refresh_token, self._token_expiry))
+            return refreshed
+        finally:
+            with _refresh_lock:
+                _refresh_futures.pop(key, None)
+    
+    def _adopt_shared_token(self) -> None:
+        """Switch to a newer token refreshed by another instance for this account."""
+        if self._token_key is None:
+            return
+        shared = _shared_cache_get(self._TOKENS_CACHE, self._token_key, REFRESHED_TOKEN_TTL)
+        if shared is None or shared[0] == self.access_token:
+            return
+        access_token, refresh_token, expiry = shared
+        if self._token_expiry is not None and (expiry is None or expiry <= self._token_expiry):
+            return
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self._token_expiry = expiry
+        self._token_checked_until = 0.0
+    
     def set_token_refresh_callback(self, callback: callable) -> None:
         """Set a callback function to be called when tokens are refreshed.
         
@@ -168,247 +431,475 @@ class OutlookService:
         self.token_refresh_callback = callback
     
     def _get_headers(self) -> Dict[str, str]:
-        """Get headers for API requests."""
-        return {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
+        """Get headers for API requests.
+        
+        The returned dict is shared; copy it before adding headers.
+        """
+        headers_key = (self.access_token, self.prefer_text_body)
+        if self._headers_token != headers_key:
+            self._headers = {
+                'Authorization': f'Bearer {self.access_token}',
+                'Content-Type': 'application/json'
+            }
+            if self.prefer_text_body:
+                self._headers['Prefer'] = PREFER_TEXT_BODY
+            self._headers_token = headers_key
+        return self._headers
+    
+    def _graph_batch(self, requests: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """Send Graph sub-requests through JSON batching.
+        
+        Each request is a dict with 'method' and a 'url' relative to the API
+        version (e.g. '/me/messages/{id}'). Requests are sent in chunks of 20;
+        throttled (429) and transient 5xx sub-requests are retried after their
+        Retry-After delay. If a batch call itself fails, its requests are sent
+        one by one instead. Returns the sub-responses in request order.
+        """
+        responses: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+        headers = self._get_headers()
+        
+        for start in range(0, len(requests), GRAPH_BATCH_LIMIT):
+            pending = {
+                str(index): requests[index]
+                for index in range(start, min(start + GRAPH_BATCH_LIMIT, len(requests)))
+            }
+            attempts = 0
+            
+            while pending:
+                body = {'requests': [{'id': request_id, **request} for request_id, request in pending.items()]}
+                response = self.session.post(GRAPH_BATCH_URL, headers=headers, json=body, timeout=60)
+                if response.status_code != 200:
+                    # The session already retried the batch call; fall back to plain requests
+                    logger.warning(f"Batch request failed: {response.status_code}, sending {len(pending)} requests individually")
+                    for request_id, request in pending.items():
+                        responses[int(request_id)] = self._send_request(request)
+                    break
+                
+                throttled = {}
+                retry_after = 0
+                for sub_response in _json(response).get('responses', []):
+                    request_id = sub_response['id']
+                    if sub_response.get('status') in RETRY_STATUSES and attempts < GRAPH_BATCH_MAX_RETRIES:
+                        throttled[request_id] = pending[request_id]
+                        delay = (sub_response.get('headers') or {}).get('Retry-After')
+                        retry_after = max(retry_after, _retry_after(delay, attempts))
+                    else:
+                        responses[int(request_id)] = sub_response
+                
+                pending = throttled
+                if pending:
+                    attempts += 1
+                    time.sleep(retry_after)
+        
+        return responses
+    
+    def _send_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Send one batch sub-request on its own, returning it in sub-response form."""
+        response = self.session.request(
+            request['method'],
+            f"{GRAPH_BASE_URL}{request['url']}",
+            headers={**self._get_headers(), **request.get('headers', {})},
+            json=request.get('body'),
+            timeout=30
+        )
+        try:
+            body = _json(response)
+        except ValueError:
+            body = {}
+        return {'status': response.status_code, 'headers': dict(response.headers), 'body': body}
     
     def get_folders(self) -> List[Dict[str, str]]:
         """Get list of Outlook mail folders."""
         try:
+            cached = self._cached_folders()
+            if cached is not None:
+                return cached
+            
             if not self._ensure_valid_token():
                 raise Exception("Outlook service not authenticated or token refresh failed")
             
             headers = self._get_headers()
-            response = self.session.get(
-                f"{GRAPH_BASE_URL}/me/mailFolders",
-                headers=headers,
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"API request failed: {response.status_code} - {response.text}")
-            
-            data = response.json()
+            url = f"{GRAPH_BASE_URL}/me/mailFolders"
+            params = {'$top': FOLDERS_PAGE_SIZE}
             folders = []
             
-            for folder in data.get('value', []):
-                folders.append({
-                    'id': folder['id'],
-                    'name': folder['displayName'],
-                    'type': 'system' if folder.get('isHidden', False) else 'user'
-                })
+            while url:
+                response = self.session.get(url, headers=headers, params=params, timeout=30)
+                
+                if response.status_code != 200:
+                    raise Exception(f"API request failed: {response.status_code} - {response.text}")
+                
+                data = _json(response)
+                folders.extend(self._folder_entry(folder) for folder in data.get('value', []))
+                
+                # nextLink already carries the query parameters
+                url = data.get('@odata.nextLink')
+                params = None
             
-            return folders
+            self._cache_folders(folders)
+            return list(folders)
             
         except Exception as e:
             logger.error(f"Error getting Outlook folders: {str(e)}")
             return []
     
+    def _folder_entry(self, folder: Dict[str, Any]) -> Dict[str, str]:
+        """Convert a Graph mailFolder to a folder entry."""
+        return {
+            'id': folder['id'],
+            'name': folder['displayName'],
+            'type': 'system' if folder.get('isHidden', False) else 'user'
+        }
+    
+    def _cached_folders(self) -> Optional[List[Dict[str, str]]]:
+        """Return this account's folder listing if it was fetched recently."""
+        if self.account_id is None:
+            return None
+        cached = _shared_cache_get(self._FOLDERS_CACHE, self.account_id, FOLDERS_CACHE_TTL)
+        return list(cached) if cached is not None else None
+    
+    def _cache_folders(self, folders: List[Dict[str, str]]) -> None:
+        """Remember this account's folder listing for FOLDERS_CACHE_TTL seconds."""
+        if self.account_id is not None:
+            _shared_cache_put(self._FOLDERS_CACHE, self.account_id, folders)
+    
     def get_messages(self, folder_id: str = 'inbox', max_results: int = 100, 
-                    query: str = '') -> List[Dict[str, Any]]:
-        """Get messages from Outlook."""
+                    query: str = '', include_body: bool = True,
+                    include_attachments: bool = False) -> List[Dict[str, Any]]:
+        """Get messages from Outlook.
+        
+        With include_body=False only bodyPreview is fetched and used as the
+        body; get_message_body fetches the full body on demand. With
+        include_attachments=True attachment metadata comes back in the same
+        listing instead of one get_message_attachments call per message.
+        """
         try:
-            if not self._ensure_valid_token():
-                raise Exception("Outlook service not authenticated or token refresh failed")
+            page_size = min(max_results, MESSAGES_PAGE_SIZE)
+            pages = self.iter_messages(folder_id, query, page_size, include_body, include_attachments)
+            messages = itertools.islice(pages, max_results)
+            return self._process_messages(messages)
             
-            headers = self._get_headers()
+        except Exception as e:
+            logger.error(f"Error getting Outlook messages: {str(e)}")
+            return []
+    
+    def iter_messages(self, folder_id: str = 'inbox', query: str = '',
+                      page_size: int = MESSAGES_PAGE_SIZE, include_body: bool = True,
+                      include_attachments: bool = False) -> Iterator[Dict[str, Any]]:
+        """Yield raw Graph messages page by page, following @odata.nextLink."""
+        if not self._ensure_valid_token():
+            raise Exception("Outlook service not authenticated or token refresh failed")
+        
+        headers = self._get_headers()
+        url, params = self._messages_request(folder_id, page_size, query, include_body, include_attachments)
+        
+        while url:
+            response = self.session.get(url, headers=headers, params=params, timeout=30)
             
-            # Build query parameters
-            params = {
-                '$top': min(max_results, 1000),  # Graph API limit
-                '$select': 'id,subject,from,toRecipients,body,bodyPreview,receivedDateTime,isRead,parentFolderId,conversationId,internetMessageId',
-                '$orderby': 'receivedDateTime desc'
-            }
+            if response.status_code != 200:
+                raise Exception(f"API request failed: {response.status_code} - {response.text}")
             
-            if query:
-                params['$filter'] = f"contains(subject,'{query}') or contains(body/content,'{query}')"
+            data = _json(response)
+            yield from data.get('value', [])
             
-            # Get messages
-            url = f"{GRAPH_BASE_URL}/me/mailFolders/{folder_id}/messages"
+            # nextLink already carries the query parameters
+            url = data.get('@odata.nextLink')
+            params = None
+    
+    def iter_message_changes(self, folder_id: str = 'inbox', page_size: int = MESSAGES_PAGE_SIZE,
+                             include_body: bool = True, since: Optional[str] = None,
+                             max_messages: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Yield raw Graph messages from a delta query, storing the new deltaLink at the end.
+        
+        Messages deleted or moved out of the folder come through as entries
+        carrying '@removed'. A fresh round can be limited to messages received
+        at or after since; when a stored delta link has expired, the cutoff
+        for the fresh round is taken from max_messages instead.
+        """
+        if not self._ensure_valid_token():
+            raise Exception("Outlook service not authenticated or token refresh failed")
+        
+        # Delta queries take their page size from the Prefer header, not $top
+        headers = self._get_headers()
+        prefer = f'odata.maxpagesize={page_size}'
+        headers = {**headers, 'Prefer': f"{headers['Prefer']}, {prefer}" if 'Prefer' in headers else prefer}
+        url = self._delta_links.get(folder_id)
+        params = None
+        if not url:
+            url = f"{GRAPH_BASE_URL}/me/mailFolders/{folder_id}/messages/delta"
+            params = {'$select': f"{MESSAGE_SELECT},body" if include_body else MESSAGE_SELECT}
+            if since:
+                params['$filter'] = f"receivedDateTime ge {since}"
+        
+        while url:
             response = self.session.get(url, headers=headers, params=params, timeout=30)
             
+            if response.status_code == 410 and folder_id in self._delta_links:
+                # The delta state expired; start a fresh round
+                logger.warning(f"Delta link for folder {folder_id} expired, resyncing")
+                del self._delta_links[folder_id]
+                if since is None and max_messages:
+                    since = self._changes_cutoff(folder_id, max_messages)
+                yield from self.iter_message_changes(folder_id, page_size, include_body, since)
+                return
+            
             if response.status_code != 200:
                 raise Exception(f"API request failed: {response.status_code} - {response.text}")
             
-            data = response.json()
-            messages = []
+            data = _json(response)
+            yield from data.get('value', [])
             
-            for msg in data.get('value', []):
-                try:
-                    message_detail = self._process_message(msg)
-                    if message_detail:
-                        messages.append(message_detail)
-                except Exception as e:
-                    logger.warning(f"Error processing message {msg.get('id', 'unknown')}: {str(e)}")
-                    continue
-            
-            return messages
-            
-        except Exception as e:
-            logger.error(f"Error getting Outlook messages: {str(e)}")
-            return []
+            # nextLink and deltaLink already carry the query parameters
+            url = data.get('@odata.nextLink')
+            params = None
+            if '@odata.deltaLink' in data:
+                self._delta_links[folder_id] = data['@odata.deltaLink']
+    
+    def _changes_cutoff(self, folder_id: str, max_messages: int) -> Optional[str]:
+        """Get the receivedDateTime of the max_messages-th newest message, or None if there are fewer."""
+        response = self.session.get(
+            f"{GRAPH_BASE_URL}/me/mailFolders/{folder_id}/messages",
+            headers=self._get_headers(),
+            params={
+                '$select': 'receivedDateTime',
+                '$orderby': 'receivedDateTime desc',
+                '$top': 1,
+                '$skip': max(max_messages, 1) - 1
+            },
+            timeout=30
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"API request failed: {response.status_code} - {response.text}")
+        
+        values = _json(response).get('value', [])
+        return values[0].get('receivedDateTime') if values else None
+    
+    def _messages_request(self, folder_id: str, page_size: int, query: str = '',
+                          include_body: bool = True,
+                          include_attachments: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """Build the URL and query parameters for the first page of folder messages."""
+        params = {
+            '$top': page_size,
+            '$select': f"{MESSAGE_SELECT},body" if include_body else MESSAGE_SELECT,
+            '$orderby': 'receivedDateTime desc'
+        }
+        
+        if include_attachments:
+            params['$expand'] = ATTACHMENTS_EXPAND
+        
+        if query and SIMPLE_QUERY_RE.match(query):
+            # Index-backed and already newest first; $search cannot be combined with $orderby
+            del params['$orderby']
+            params['$search'] = f'"{query}"'
+        elif query:
+            quoted = _odata_escape(query)
+            params['$filter'] = f"contains(subject,'{quoted}') or contains(body/content,'{quoted}')"
+        
+        return f"{GRAPH_BASE_URL}/me/mailFolders/{folder_id}/messages", params
+    
+    def _process_messages(self, values: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Process the messages of a Graph API list response."""
+        return self._map_messages(self._process_message, values)
+    
+    def _map_messages(self, convert: Callable[[Dict[str, Any]], Any], values: Iterable[Dict[str, Any]]) -> List[Any]:
+        """Convert messages on a thread pool, dropping the ones that fail."""
+        def convert_one(msg: Dict[str, Any]) -> Any:
+            try:
+                return convert(msg)
+            except Exception as e:
+                logger.warning(f"Error processing message {msg.get('id', 'unknown')}: {str(e)}")
+                return None
+        
+        # Load the folder map up front so worker threads only read it
+        values = list(values)
+        self._resolve_folder_names(values)
+        
+        with ThreadPoolExecutor(max_workers=PROCESS_MAX_WORKERS) as executor:
+            return [message for message in executor.map(convert_one, values) if message]
     
     def _process_message(self, msg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Process a single message from Graph API response."""
         try:
-            # Extract basic info
-            message_id = msg.get('id', '')
-            subject = msg.get('subject', '')
-            received_date = msg.get('receivedDateTime', '')
-            is_read = msg.get('isRead', False)
             parent_folder_id = msg.get('parentFolderId', '')
-            conversation_id = msg.get('conversationId', '')
-            internet_message_id = msg.get('internetMessageId', '')
-            snippet = msg.get('bodyPreview', '')
-            
-            # Extract sender
-            sender_info = msg.get('from', {})
-            sender = sender_info.get('emailAddress', {}).get('address', '') if sender_info else ''
-            
-            # Extract receiver
-            to_recipients = msg.get('toRecipients', [])
-            receiver = ', '.join([r.get('emailAddress', {}).get('address', '') for r in to_recipients])
-            
-            # Extract body
-            body_content = msg.get('body', {})
-            body = body_content.get('content', '') if body_content else ''
-            content_type = body_content.get('contentType', 'text')
-            
-            # Convert HTML to text if needed
-            if content_type == 'html':
-                body = self._html_to_text(body)
-            
-            # Parse date
-            internal_date = None
-            if received_date:
-                try:
-                    # Parse ISO format date
-                    dt = datetime.fromisoformat(received_date.replace('Z', '+00:00'))
-                    internal_date = int(dt.timestamp() * 1000)
-                except Exception as e:
-                    logger.warning(f"Error parsing date {received_date}: {str(e)}")
-                    internal_date = int(datetime.now(timezone.utc).timestamp() * 1000)
-            else:
-                internal_date = int(datetime.now(timezone.utc).timestamp() * 1000)
-            
-            # Get folder name
-            folder = self._get_folder_name(parent_folder_id)
             
             return {
-                'message_id': message_id,
-                'subject': subject,
-                'sender': sender,
-                'receiver': receiver,
-                'body': body,
-                'is_read': is_read,
-                'folder': folder,
-                'internal_date': internal_date,
+                'message_id': msg.get('id', ''),
+                'subject': msg.get('subject', ''),
+                'sender': self._extract_sender(msg),
+                'receiver': self._extract_receiver(msg),
+                'body': self._extract_body(msg),
+                'is_read': msg.get('isRead', False),
+                'folder': self._get_folder_name(parent_folder_id),
+                'internal_date': self._parse_received_date(msg.get('receivedDateTime', '')),
                 'raw_data': msg,
-                'conversation_id': conversation_id,
-                'snippet': snippet,
-                'internet_message_id': internet_message_id,
-                'parent_folder_id': parent_folder_id
+                'conversation_id': msg.get('conversationId', ''),
+                'snippet': msg.get('bodyPreview', ''),
+                'internet_message_id': msg.get('internetMessageId', ''),
+                'parent_folder_id': parent_folder_id,
+                'attachments': msg.get('attachments', [])
             }
             
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
             return None
     
+    def _build_email_message(self, msg: Dict[str, Any], account: EmailAccount) -> EmailMessageCreate:
+        """Build an EmailMessageCreate straight from a Graph API message."""
+        return EmailMessageCreate(
+            message_id=msg.get('id', ''),
+            lead_id=msg.get('conversationId', ''),  # Will be set later if needed
+            owner=account.email,
+            sender=self._extract_sender(msg),
+            receiver=self._extract_receiver(msg),
+            subject=msg.get('subject', ''),
+            body=self._extract_body(msg),
+            is_read=msg.get('isRead', False),
+            folder=self._get_folder_name(msg.get('parentFolderId', '')),
+            raw_data=None,  # Not persisted; keeping it would pin the full Graph payload
+            summary=msg.get('bodyPreview', ''),  # Will be generated later
+            internal_date=self._parse_received_date(msg.get('receivedDateTime', '')),
+            history_id=None  # Outlook doesn't have history_id like Gmail, set to None
+        )
+    
+    def _extract_sender(self, msg: Dict[str, Any]) -> str:
+        """Extract the sender address of a message."""
+        sender_info = msg.get('from')
+        return _addr(sender_info) if sender_info else ''
+    
+    def _extract_receiver(self, msg: Dict[str, Any]) -> str:
+        """Extract the comma-separated recipient addresses of a message."""
+        to_recipients = msg.get('toRecipients')
+        return ', '.join(map(_addr, to_recipients)) if to_recipients else ''
+    
+    def _extract_body(self, msg: Dict[str, Any]) -> str:
+        """Extract the message body as text."""
+        # Fall back to the preview when the body was not selected
+        body_content = msg.get('body')
+        if not body_content:
+            return msg.get('bodyPreview', '')
+        
+        body = body_content.get('content', '')
+        
+        # Convert HTML to text if needed
+        if body_content.get('contentType', 'text') == 'html':
+            body = self._html_to_text(body)
+        return body
+    
+    def _parse_received_date(self, received_date: str) -> int:
+        """Parse a receivedDateTime to epoch milliseconds."""
+        if received_date:
+            try:
+                # Parse RFC 3339 date (trailing Z included) in C
+                dt = ciso8601.parse_datetime(received_date)
+                return int(dt.timestamp() * 1000)
+            except Exception as e:
+                logger.warning(f"Error parsing date {received_date}: {str(e)}")
+        return int(datetime.now(timezone.utc).timestamp() * 1000)
+    
     def _html_to_text(self, html: str) -> str:
-        """Simple HTML to text conversion."""
-        # Remove HTML tags
-        text = re.sub(r'<[^>]+>', '', html)
-        # Decode HTML entities
-        text = text.replace('&nbsp;', ' ')
-        text = text.replace('&amp;', '&')
-        text = text.replace('&lt;', '<')
-        text = text.replace('&gt;', '>')
-        text = text.replace('&quot;', '"')
-        text = text.replace('&#39;', "'")
-        # Clean up whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
-        return text
+        """Convert HTML to plain text."""
+        try:
+            tree = lxml.html.document_fromstring(html.encode('utf-8'), parser=HTML_PARSER)
+        except (etree.ParserError, ValueError):
+            return ''
+        # Drop non-visible content in one C-level pass, keeping the text after it
+        etree.strip_elements(tree, 'script', 'style', with_tail=False)
+        return WHITESPACE_RE.sub(' ', tree.text_content()).strip()
+    
+    def _resolve_folder_names(self, values: List[Dict[str, Any]]) -> None:
+        """Load the folder map, fetching the folders it is missing in one batch."""
+        folder_cache = self._ensure_folder_cache()
+        missing = list({msg.get('parentFolderId') for msg in values} - folder_cache.keys() - {None, ''})
+        if not missing:
+            return
+        
+        try:
+            responses = self._graph_batch([
+                {'method': 'GET', 'url': f"/me/mailFolders/{folder_id}?$select=displayName"}
+                for folder_id in missing
+            ])
+        except Exception as e:
+            logger.warning(f"Error getting folder names: {str(e)}")
+            responses = [None] * len(missing)
+        
+        for folder_id, response in zip(missing, responses):
+            if response and response.get('status') == 200:
+                folder_cache[folder_id] = response.get('body', {}).get('displayName', 'unknown').lower()
+            else:
+                folder_cache[folder_id] = FOLDER_MAPPINGS.get(folder_id.lower(), 'inbox')
+    
+    def _ensure_folder_cache(self) -> Dict[str, str]:
+        """Load the folder ID to name map once per authentication."""
+        if self._folder_cache is None:
+            # Seeded from the shared folder listing; a failed load is cached
+            # as empty so it is not retried for every message
+            self._folder_cache = self._folder_names(self.get_folders())
+        return self._folder_cache
+    
+    def _folder_names(self, folders: List[Dict[str, str]]) -> Dict[str, str]:
+        """Map folder IDs to lowercase display names."""
+        return {folder['id']: folder['name'].lower() for folder in folders}
     
     def _get_folder_name(self, folder_id: str) -> str:
         """Get folder name from folder ID."""
-        # Common Outlook folder mappings
-        folder_mappings = {
-            'inbox': 'inbox',
-            'drafts': 'drafts',
-            'sentitems': 'sent',
-            'deleteditems': 'deleted',
-            'junkemail': 'junk',
-            'outbox': 'outbox'
-        }
+        if not folder_id:
+            return 'inbox'
         
-        # Try to get folder name from API
+        # Folders missing from the map (e.g. child folders) are fetched once and memoized
+        folder_cache = self._ensure_folder_cache()
+        if folder_id not in folder_cache:
+            folder_cache[folder_id] = self._fetch_folder_name(folder_id)
+        return folder_cache[folder_id]
+    
+    def _fetch_folder_name(self, folder_id: str) -> str:
+        """Fetch a single folder name from the API."""
         try:
-            if not self._ensure_valid_token():
-                logger.warning("Cannot get folder name: token validation failed")
-                return folder_mappings.get(folder_id.lower(), 'inbox')
-            
-            headers = self._get_headers()
             response = self.session.get(
                 f"{GRAPH_BASE_URL}/me/mailFolders/{folder_id}",
-                headers=headers,
+                headers=self._get_headers(),
+                params={'$select': 'displayName'},
                 timeout=30
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = _json(response)
                 return data.get('displayName', 'unknown').lower()
         except Exception as e:
             logger.warning(f"Error getting folder name for {folder_id}: {str(e)}")
         
         # Fallback to mapping
-        return folder_mappings.get(folder_id.lower(), 'inbox')
+        return FOLDER_MAPPINGS.get(folder_id.lower(), 'inbox')
     
     def get_message_for_database(self, account: EmailAccount, user_id: str, 
-                               max_messages: int = 100, folder: Optional[str] = None) -> List[EmailMessageCreate]:
-        """Sync Outlook emails to database format."""
+                               max_messages: int = 100, folder: Optional[str] = None,
+                               include_body: bool = True) -> List[EmailMessageCreate]:
+        """Sync Outlook emails to database format.
+        
+        folder=ALL_FOLDERS syncs up to max_messages from each mail folder.
+        """
         try:
             # Set tokens
             self.access_token = account.access_token
             self.refresh_token = account.refresh_token
+            self.account_id = account.id
             
             # Authenticate
             if not self.authenticate_with_token(account.access_token, account.refresh_token):
                 raise Exception("Failed to authenticate with Outlook")
             
-            # Get messages
-            messages = self.get_messages(
-                folder_id=folder or 'inbox',
-                max_results=max_messages
-            )
+            if folder == ALL_FOLDERS:
+                folder_ids = [entry['id'] for entry in self.get_folders()]
+            else:
+                folder_ids = [folder or 'inbox']
             
-            # Convert to EmailMessageCreate objects
-            email_messages = []
-            for msg in messages:
-                try:
-                    email_msg = EmailMessageCreate(
-                        message_id=msg['message_id'],
-                        lead_id=msg['conversation_id'],  # Will be set later if needed
-                        owner=account.email,
-                        sender=msg['sender'],
-                        receiver=msg['receiver'],
-                        subject=msg['subject'],
-                        body=msg['body'],
-                        is_read=msg['is_read'],
-                        folder=msg['folder'],
-                        raw_data=msg['raw_data'],
-                        summary=msg['snippet'],  # Will be generated later
-                        internal_date=msg['internal_date'],
-                        history_id=None  # Outlook doesn't have history_id like Gmail, set to None
-                    )
-                    email_messages.append(email_msg)
-                    
-                except Exception as e:
-                    logger.warning(f"Error converting message {msg.get('message_id', 'unknown')}: {str(e)}")
-                    continue
-            
-            return email_messages
+            # Build database rows straight from the raw Graph messages
+            page_size = min(max_messages, MESSAGES_PAGE_SIZE)
+            pages = itertools.chain.from_iterable(
+                itertools.islice(self.iter_messages(folder_id, '', page_size, include_body), max_messages)
+                for folder_id in folder_ids
+            )
+            return self._to_email_messages(pages, account)
             
         except Exception as e:
             logger.error(f"Error syncing Outlook emails: {str(e)}")
@@ -417,36 +908,130 @@ class OutlookService:
     
     
     
-    def get_unread_count(self, folder_id: str = 'inbox') -> int:
-        """Get count of unread messages in a folder."""
+    def get_message_changes_for_database(self, account: EmailAccount, folder: Optional[str] = None,
+                                         delta_link: Optional[str] = None, max_messages: int = 100,
+                                         include_body: bool = True) -> Tuple[List[EmailMessageCreate], List[str], Optional[str]]:
+        """Sync the changes of an Outlook folder since delta_link to database format.
+        
+        Without a delta_link the first round covers the newest max_messages
+        messages. Returns the added or changed messages, the IDs of messages
+        deleted or moved out of the folder, and the deltaLink for the next
+        call, which is None if the round did not complete.
+        """
+        try:
+            self.account_id = account.id
+            if not self.authenticate_with_token(account.access_token, account.refresh_token):
+                raise Exception("Failed to authenticate with Outlook")
+            
+            folder_id = folder or 'inbox'
+            since = None
+            if delta_link:
+                self._delta_links[folder_id] = delta_link
+            else:
+                since = self._changes_cutoff(folder_id, max_messages)
+            
+            changes = list(self.iter_message_changes(folder_id, include_body=include_body, since=since,
+                                                     max_messages=max_messages))
+            removed = [msg['id'] for msg in changes if '@removed' in msg]
+            messages = self._to_email_messages([msg for msg in changes if '@removed' not in msg], account)
+            return messages, removed, self._delta_links.get(folder_id)
+            
+        except Exception as e:
+            logger.error(f"Error syncing Outlook email changes: {str(e)}")
+            return [], [], None
+    
+    def _to_email_messages(self, values: Iterable[Dict[str, Any]], account: EmailAccount) -> List[EmailMessageCreate]:
+        """Convert Graph API messages to EmailMessageCreate objects."""
+        return self._map_messages(lambda msg: self._build_email_message(msg, account), values)
+    
+    def get_message_body(self, message_id: str) -> str:
+        """Fetch the full body of a message as text."""
         try:
             if not self._ensure_valid_token():
                 raise Exception("Outlook service not authenticated or token refresh failed")
             
-            headers = self._get_headers()
-            params = {
-                '$filter': 'isRead eq false',
-                '$count': 'true'
-            }
-            
             response = self.session.get(
-                f"{GRAPH_BASE_URL}/me/mailFolders/{folder_id}/messages",
-                headers=headers,
-                params=params,
+                f"{GRAPH_BASE_URL}/me/messages/{message_id}",
+                headers=self._get_headers(),
+                params={'$select': 'body'},
                 timeout=30
             )
             
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('@odata.count', 0)
-            else:
-                logger.error(f"Error getting unread count: {response.status_code} - {response.text}")
+            if response.status_code != 200:
+                raise Exception(f"API request failed: {response.status_code} - {response.text}")
+            
+            body_content = _json(response).get('body') or {}
+            body = body_content.get('content', '')
+            if body_content.get('contentType') == 'html':
+                body = self._html_to_text(body)
+            return body
+            
+        except Exception as e:
+            logger.error(f"Error getting body for message {message_id}: {str(e)}")
+            return ''
+    
+    def get_unread_count(self, folder_id: str = 'inbox') -> int:
+        """Get count of unread messages in a folder, reusing counts up to UNREAD_COUNT_TTL seconds old."""
+        try:
+            cache_key = (self.account_id, folder_id)
+            if self.account_id is not None:
+                cached = _shared_cache_get(self._UNREAD_CACHE, cache_key, UNREAD_COUNT_TTL)
+                if cached is not None:
+                    return cached
+            
+            count = self._fetch_unread_count(folder_id)
+            if count is None:
                 return 0
-                
+            
+            if self.account_id is not None:
+                _shared_cache_put(self._UNREAD_CACHE, cache_key, count)
+            return count
+            
         except Exception as e:
             logger.error(f"Error getting unread count: {str(e)}")
             return 0
     
+    def _fetch_unread_count(self, folder_id: str) -> Optional[int]:
+        """Count the unread messages of a folder, or None if the request failed."""
+        if not self._ensure_valid_token():
+            raise Exception("Outlook service not authenticated or token refresh failed")
+        
+        # The $count segment returns just the number as plain text
+        headers = {**self._get_headers(), 'ConsistencyLevel': 'eventual'}
+        response = self.session.get(
+            f"{GRAPH_BASE_URL}/me/mailFolders/{folder_id}/messages/$count",
+            headers=headers,
+            params={'$filter': 'isRead eq false'},
+            timeout=30
+        )
+        
+        if response.status_code == 200:
+            return int(response.text)
+        
+        logger.warning(f"Unread $count request failed: {response.status_code} - {response.text}")
+        
+        # Fall back to the counted list, fetching a single id-only row
+        params = {
+            '$filter': 'isRead eq false',
+            '$count': 'true',
+            '$top': 1,
+            '$select': 'id'
+        }
+        
+        response = self.session.get(
+            f"{GRAPH_BASE_URL}/me/mailFolders/{folder_id}/messages",
+            headers=self._get_headers(),
+            params=params,
+            timeout=30
+        )
+        
+        if response.status_code == 200:
+            data = _json(response)
+            return data.get('@odata.count', 0)
+        
+        logger.error(f"Error getting unread count: {response.status_code} - {response.text}")
+        return None
+    
     def mark_as_read(self, message_id: str) -> bool:
         """Mark a message as read."""
         try:
@@ -465,48 +1050,56 @@ class OutlookService:
                 timeout=30
             )
             
-            return response.status_code == 200
+            if response.status_code != 200:
+                return False
+            
+            # Any folder's cached unread count may now be stale
+            with _shared_cache_lock:
+                for cache_key in [key for key in self._UNREAD_CACHE if key[0] == self.account_id]:
+                    del self._UNREAD_CACHE[cache_key]
+            return True
             
         except Exception as e:
             logger.error(f"Error marking message as read: {str(e)}")
             return False
     
-    def get_message_thread(self, conversation_id: str) -> List[Dict[str, Any]]:
-        """Get all messages in a conversation."""
+    def get_message_thread(self, conversation_id: str, folder_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get all messages in a conversation.
+        
+        Passing the folder the conversation lives in (e.g. a message's
+        parent_folder_id) scopes the lookup to that folder, which Graph
+        serves faster than the mailbox-wide listing.
+        """
         try:
             if not self._ensure_valid_token():
                 raise Exception("Outlook service not authenticated or token refresh failed")
             
             headers = self._get_headers()
-            params = {
-                '$filter': f"conversationId eq '{conversation_id}'",
-                '$orderby': 'receivedDateTime asc'
-            }
+            url, params = self._thread_request(conversation_id, folder_id)
             
-            response = self.session.get(
-                f"{GRAPH_BASE_URL}/me/messages",
-                headers=headers,
-                params=params,
-                timeout=30
-            )
+            response = self.session.get(url, headers=headers, params=params, timeout=30)
             
             if response.status_code != 200:
                 raise Exception(f"API request failed: {response.status_code} - {response.text}")
             
-            data = response.json()
-            messages = []
-            
-            for msg in data.get('value', []):
-                message_detail = self._process_message(msg)
-                if message_detail:
-                    messages.append(message_detail)
-            
-            return messages
+            data = _json(response)
+            return self._process_messages(data.get('value', []))
             
         except Exception as e:
             logger.error(f"Error getting conversation {conversation_id}: {str(e)}")
             return []
     
+    def _thread_request(self, conversation_id: str, folder_id: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        """Build the URL and query parameters for listing a conversation."""
+        params = {
+            '$top': MESSAGES_PAGE_SIZE,
+            '$filter': f"conversationId eq '{_odata_escape(conversation_id)}'",
+            '$orderby': 'receivedDateTime asc'
+        }
+        if folder_id:
+            return f"{GRAPH_BASE_URL}/me/mailFolders/{folder_id}/messages", params
+        return f"{GRAPH_BASE_URL}/me/messages", params
+    
     def get_message_attachments(self, message_id: str) -> List[Dict[str, Any]]:
         """Get attachments for a message."""
         try:
@@ -521,7 +1114,7 @@ class OutlookService:
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = _json(response)
                 return data.get('value', [])
             else:
                 logger.error(f"Error getting attachments: {response.status_code} - {response.text}")
@@ -530,3 +1123,207 @@ class OutlookService:
         except Exception as e:
             logger.error(f"Error getting attachments: {str(e)}")
             return []
+
+
+async def get_aiohttp_session() -> aiohttp.ClientSession:
+    """Get the shared aiohttp session, creating it inside the running loop."""
+    global _aiohttp_session
+    if _aiohttp_session is None or _aiohttp_session.closed:
+        _aiohttp_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=20),
+            timeout=aiohttp.ClientTimeout(total=30)
+        )
+    return _aiohttp_session
+
+
+async def close_aiohttp_session() -> None:
+    """Close the shared aiohttp session."""
+    global _aiohttp_session
+    if _aiohttp_session is not None:
+        await _aiohttp_session.close()
+        _aiohttp_session = None
+
+
+class AsyncOutlookService(OutlookService):
+    """Outlook service whose Graph reads are awaitable and run concurrently.
+    
+    Awaitable reads are the aget_* counterparts of the OutlookService
+    methods of the same name and go through a shared aiohttp session.
+    Token checks and message conversion reuse the synchronous
+    implementation in worker threads so they never block the event loop;
+    the inherited synchronous methods still work and stay blocking.
+    """
+    
+    async def _ensure_token(self) -> bool:
+        """Run the blocking token check (a /me probe or refresh) in a worker thread."""
+        return await asyncio.to_thread(self._ensure_valid_token)
+    
+    async def _get_json(self, url: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """GET a Graph URL and return the decoded JSON body.
+        
+        Throttled and transient failures are retried, honouring Retry-After.
+        """
+        session = await get_aiohttp_session()
+        for attempt in range(RETRY_MAX_ATTEMPTS + 1):
+            async with session.get(url, headers=self._get_headers(), params=params) as response:
+                if response.status == 200:
+                    return orjson.loads(await response.read())
+                if response.status not in RETRY_STATUSES or attempt == RETRY_MAX_ATTEMPTS:
+                    raise Exception(f"API request failed: {response.status} - {await response.text()}")
+                delay = _retry_after(response.headers.get('Retry-After'), attempt)
+            
+            logger.warning(f"Graph request returned {response.status}, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+    
+    async def _load_folder_cache(self) -> Dict[str, str]:
+        """Load the folder ID to name map without blocking the event loop."""
+        if self._folder_cache is None:
+            self._folder_cache = self._folder_names(await self.aget_folders())
+        return self._folder_cache
+    
+    async def _fetch_folder_name_async(self, folder_id: str) -> str:
+        """Fetch a single folder name from the API."""
+        try:
+            data = await self._get_json(f"{GRAPH_BASE_URL}/me/mailFolders/{folder_id}",
+                                        {'$select': 'displayName'})
+            return data.get('displayName', 'unknown').lower()
+        except Exception as e:
+            logger.warning(f"Error getting folder name for {folder_id}: {str(e)}")
+            return FOLDER_MAPPINGS.get(folder_id.lower(), 'inbox')
+    
+    async def aget_folders(self) -> List[Dict[str, str]]:
+        """Get list of Outlook mail folders."""
+        try:
+            cached = self._cached_folders()
+            if cached is not None:
+                return cached
+            
+            if not await self._ensure_token():
+                raise Exception("Outlook service not authenticated or token refresh failed")
+            
+            url = f"{GRAPH_BASE_URL}/me/mailFolders"
+            params = {'$top': FOLDERS_PAGE_SIZE}
+            folders = []
+            while url:
+                data = await self._get_json(url, params)
+                folders.extend(self._folder_entry(folder) for folder in data.get('value', []))
+                url = data.get('@odata.nextLink')
+                params = None
+            
+            self._cache_folders(folders)
+            return list(folders)
+            
+        except Exception as e:
+            logger.error(f"Error getting Outlook folders: {str(e)}")
+            return []
+    
+    async def _process_page(self, values: List[Dict[str, Any]], folder_cache: Dict[str, str],
+                            convert: Optional[Callable[[List[Dict[str, Any]]], List[Any]]] = None) -> List[Any]:
+        """Resolve unknown folders of a page concurrently, then convert it."""
+        # Each unknown folder is fetched once, so processing never blocks
+        missing = list({msg.get('parentFolderId') for msg in values} - folder_cache.keys() - {None, ''})
+        names = await asyncio.gather(*(self._fetch_folder_name_async(folder_id) for folder_id in missing))
+        folder_cache.update(zip(missing, names))
+        
+        # Conversion parses HTML on its own thread pool; keep it off the loop
+        return await asyncio.to_thread(convert or self._process_messages, values)
+    
+    async def _get_processed(self, url: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """List messages while the folder map loads, then process them."""
+        folder_cache, data = await asyncio.gather(self._load_folder_cache(), self._get_json(url, params))
+        return await self._process_page(data.get('value', []), folder_cache)
+    
+    async def aget_messages(self, folder_id: str = 'inbox', max_results: int = 100,
+                            query: str = '', include_body: bool = True,
+                            include_attachments: bool = False) -> List[Dict[str, Any]]:
+        """Get messages from Outlook, prefetching each next page during processing."""
+        try:
+            return await self._collect_messages(folder_id, max_results, query, include_body,
+                                                include_attachments)
+            
+        except Exception as e:
+            logger.error(f"Error getting Outlook messages: {str(e)}")
+            return []
+    
+    async def _collect_messages(self, folder_id: str, max_results: int, query: str = '',
+                                include_body: bool = True, include_attachments: bool = False,
+                                convert: Optional[Callable[[List[Dict[str, Any]]], List[Any]]] = None) -> List[Any]:
+        """Page through a folder, converting each page while the next one loads."""
+        if not await self._ensure_token():
+            raise Exception("Outlook service not authenticated or token refresh failed")
+        
+        url, params = self._messages_request(
+            folder_id, min(max_results, MESSAGES_PAGE_SIZE), query, include_body, include_attachments
+        )
+        folder_cache, data = await asyncio.gather(self._load_folder_cache(), self._get_json(url, params))
+        
+        messages = []
+        while True:
+            values = data.get('value', [])[:max_results - len(messages)]
+            next_url = data.get('@odata.nextLink')
+            next_page = None
+            if next_url and len(messages) + len(values) < max_results:
+                next_page = asyncio.ensure_future(self._get_json(next_url))
+            
+            messages.extend(await self._process_page(values, folder_cache, convert))
+            
+            if next_page is None:
+                return messages
+            data = await next_page
+    
+    async def aget_message_thread(self, conversation_id: str, folder_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get all messages in a conversation, optionally scoped to its folder."""
+        try:
+            if not await self._ensure_token():
+                raise Exception("Outlook service not authenticated or token refresh failed")
+            
+            return await self._get_processed(*self._thread_request(conversation_id, folder_id))
+            
+        except Exception as e:
+            logger.error(f"Error getting conversation {conversation_id}: {str(e)}")
+            return []
+    
+    async def aget_message_attachments(self, message_id: str) -> List[Dict[str, Any]]:
+        """Get attachments for a message."""
+        try:
+            if not await self._ensure_token():
+                raise Exception("Outlook service not authenticated or token refresh failed")
+            
+            data = await self._get_json(f"{GRAPH_BASE_URL}/me/messages/{message_id}/attachments")
+            return data.get('value', [])
+            
+        except Exception as e:
+            logger.error(f"Error getting attachments: {str(e)}")
+            return []
+    
+    async def aget_message_for_database(self, account: EmailAccount, user_id: str,
+                                        max_messages: int = 100, folder: Optional[str] = None,
+                                        include_body: bool = True) -> List[EmailMessageCreate]:
+        """Sync Outlook emails to database format.
+        
+        folder=ALL_FOLDERS syncs up to max_messages from each mail folder.
+        """
+        try:
+            # Authenticate
+            self.account_id = account.id
+            if not await asyncio.to_thread(self.authenticate_with_token, account.access_token, account.refresh_token):
+                raise Exception("Failed to authenticate with Outlook")
+            
+            if folder == ALL_FOLDERS:
+                folder_ids = [entry['id'] for entry in await self.aget_folders()]
+            else:
+                folder_ids = [folder or 'inbox']
+            
+            # Build database rows straight from the raw Graph messages
+            results = await asyncio.gather(*(
+                self._collect_messages(
+                    folder_id, max_messages, '', include_body,
+                    convert=lambda values: self._to_email_messages(values, account)
+                )
+                for folder_id in folder_ids
+            ))
+            return [message for folder_messages in results for message in folder_messages]
+            
+        except Exception as e:
+            logger.error(f"Error syncing Outlook emails: {str(e)}")
+            return []
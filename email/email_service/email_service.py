@@ -1,57 +1,69 @@
 import os
+import logging
+import asyncio
 import base64
+import copy
 import json
-from datetime import datetime, timezone
+import time
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Any, Optional
 import httpx
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from email.mime.text import MIMEText
+from email.utils import parsedate_to_datetime
 
 try:
     from common.supabase_client import get_supabase_client
+    from common.http_client import get_http_client
 except ImportError:
     import sys
     import os
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from common.supabase_client import get_supabase_client
+    from common.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+# Draft reads are cached this many seconds, for at most DRAFT_CACHE_SIZE entries
+DRAFT_CACHE_TTL = 30
+DRAFT_CACHE_SIZE = 1024
+# Cap on Supabase queries running in worker threads at once
+DB_CONCURRENCY = 50
+# Refreshed Google credentials are reused until this many seconds before expiry
+CREDENTIALS_MIN_TTL = 60
+
+_db_semaphore = asyncio.Semaphore(DB_CONCURRENCY)
 
 
 def _parse_email_timestamp(timestamp_str: str) -> str:
     """Parse email timestamp from various formats to ISO 8601"""
-    if not timestamp_str:
-        return datetime.now().isoformat()
+    # Unparseable input maps to the current time, which must stay outside the cache
+    if timestamp_str:
+        parsed = _parse_known_timestamp(timestamp_str)
+        if parsed:
+            return parsed
+    return datetime.now().isoformat()
+
+
+@lru_cache(maxsize=4096)
+def _parse_known_timestamp(timestamp_str: str) -> Optional[str]:
+    """ISO 8601 form of a parseable timestamp, or None; repeat syncs hit the cache"""
+    # API timestamps are ISO 8601, which fromisoformat parses without trial and error
+    try:
+        return datetime.fromisoformat(timestamp_str.replace('Z', '+00:00')).isoformat()
+    except ValueError:
+        pass
     
+    # Date headers are RFC 2822, sometimes with a trailing "(UTC)" comment
     try:
-        # Try parsing RFC 2822 format (Gmail format)
-        if '(' in timestamp_str and ')' in timestamp_str:
-            # Remove timezone info in parentheses
-            clean_timestamp = timestamp_str.split('(')[0].strip()
-            dt = datetime.strptime(clean_timestamp, '%a, %d %b %Y %H:%M:%S %z')
-            return dt.isoformat()
-        
-        # Try other common formats
-        formats = [
-            '%a, %d %b %Y %H:%M:%S %z',  # RFC 2822
-            '%Y-%m-%d %H:%M:%S',         # Simple format
-            '%Y-%m-%dT%H:%M:%S',         # ISO without timezone
-            '%Y-%m-%dT%H:%M:%SZ',        # ISO with Z
-            '%Y-%m-%dT%H:%M:%S.%fZ',     # ISO with microseconds
-        ]
-        
-        for fmt in formats:
-            try:
-                dt = datetime.strptime(timestamp_str, fmt)
-                return dt.isoformat()
-            except ValueError:
-                continue
-                
-        # If all parsing fails, return current time
-        return datetime.now().isoformat()
-        
-    except Exception:
-        return datetime.now().isoformat()
+        return parsedate_to_datetime(timestamp_str.partition('(')[0].rstrip()).isoformat()
+    except (TypeError, ValueError):
+        pass
+    
+    return None
 
 
 class GoogleEmailService:
@@ -124,15 +136,6 @@ class GoogleEmailService:
         return body
     
     async def send_email(self, access_token: str, to_emails: List[str], subject: str, body: str, is_html: bool = False, refresh_token: str = None) -> str:
-        credentials = Credentials(
-            token=access_token,
-            refresh_token=refresh_token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=self.client_id,
-            client_secret=self.client_secret
-        )
-        service = build('gmail', 'v1', credentials=credentials)
-        
         # Create message
         message = MIMEText(body, 'html' if is_html else 'plain')
         message['to'] = ', '.join(to_emails)
@@ -141,13 +144,14 @@ class GoogleEmailService:
         # Encode message
         raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
         
-        # Send message
-        result = service.users().messages().send(
-            userId='me',
-            body={'raw': raw_message}
-        ).execute()
+        # Send message over the shared async client instead of the blocking discovery client
+        url = "https://gmail.googleapis.com/gmail/v1/users/me/messages/send"
+        client = get_http_client()
+        response = await client.post(url, headers={'Authorization': f'Bearer {access_token}'}, json={'raw': raw_message})
+        # A rejected token raises here; EmailService refreshes it and retries
+        response.raise_for_status()
         
-        return result['id']
+        return response.json()['id']
 
 
 class OutlookEmailService:
@@ -181,13 +185,8 @@ class OutlookEmailService:
         
     #     return emails
     
-    async def send_email(self, access_token: str, to_emails: List[str], subject: str, body: str, is_html: bool = False) -> str:
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        message = {
+    def _build_message(self, to_emails: List[str], subject: str, body: str, is_html: bool = False) -> Dict[str, Any]:
+        return {
             "message": {
                 "subject": subject,
                 "body": {
@@ -199,12 +198,19 @@ class OutlookEmailService:
                 ]
             }
         }
+    
+    async def send_email(self, access_token: str, to_emails: List[str], subject: str, body: str, is_html: bool = False, refresh_token: str = None) -> str:
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        }
         
+        message = self._build_message(to_emails, subject, body, is_html)
         url = "https://graph.microsoft.com/v1.0/me/sendMail"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=message)
-            response.raise_for_status()
+        client = get_http_client()
+        response = await client.post(url, headers=headers, json=message)
+        response.raise_for_status()
         
         return "sent"  # Microsoft Graph doesn't return a message ID for sendMail
 
@@ -221,6 +227,59 @@ class EmailService:
         self.email_message_name = 'email_message'
         self.email_account_name = 'email_accounts'
         self.lead_name = 'email_lead'
+        # LRU caches of draft reads; every draft write invalidates the user's entries
+        self._draft_cache: OrderedDict = OrderedDict()
+        self._drafts_cache: OrderedDict = OrderedDict()
+        # Bumped on every draft write so reads that raced a write are not cached
+        self._draft_version = 0
+        # Strong references to fire-and-forget tasks until they finish
+        self._background_tasks = set()
+        # account_id -> Google credentials this process refreshed
+        self._credentials: Dict[str, Credentials] = {}
+        # account_id -> lock held while that account's token is being refreshed
+        self._refresh_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+    
+    async def _execute(self, query) -> Any:
+        """Run a blocking Supabase query in a worker thread"""
+        # schema() switches the profile on the shared session; pin it to this query
+        # now so another query built before this one runs cannot redirect it
+        profile = query.session.headers.get('Accept-Profile')
+        if profile:
+            query.headers['Accept-Profile'] = profile
+            query.headers['Content-Profile'] = profile
+        async with _db_semaphore:
+            return await asyncio.to_thread(query.execute)
+    
+    def _draft_table(self):
+        """Start a query on email.draft_emails"""
+        # Built fresh per query: filters mutate the builder, and the schema lives on the shared session
+        return self.admin.schema('email').from_('draft_emails')
+    
+    def _cache_get(self, cache: OrderedDict, key) -> Any:
+        """Return a cached value younger than DRAFT_CACHE_TTL, or None"""
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at >= DRAFT_CACHE_TTL:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return value
+    
+    def _cache_put(self, cache: OrderedDict, key, value) -> None:
+        """Cache a value, evicting the least recently used entries"""
+        cache[key] = (time.monotonic(), value)
+        cache.move_to_end(key)
+        while len(cache) > DRAFT_CACHE_SIZE:
+            cache.popitem(last=False)
+    
+    def _invalidate_drafts(self, user_id: str, draft_id: Optional[str] = None) -> None:
+        """Drop cached draft reads affected by a write"""
+        self._draft_version += 1
+        self._drafts_cache.pop(user_id, None)
+        if draft_id:
+            self._draft_cache.pop((user_id, draft_id), None)
     
     def _normalize_user_id(self, user_id) -> str:
         try:
@@ -233,17 +292,14 @@ class EmailService:
             return str(user_id)
     
     async def get_user_email_accounts(self, user_id: str) -> List[Dict[str, Any]]:
-        result = self.admin.schema(self.email_provider_schema_name).from_(self.email_account_name).select('*').eq('user_id', user_id).execute()
+        result = await self._execute(self.admin.schema(self.email_provider_schema_name).from_(self.email_account_name).select('*').eq('user_id', user_id))
         return result.data
     
     async def _refresh_and_save_tokens(self, account_id: str, provider_name: str, credentials) -> Dict[str, str]:
         """Refresh tokens and save to database"""
         try:
-            # Refresh the credentials
-            print(f"credentialscredentialscredentialscredentialscredentials {credentials}")
-            credentials.refresh(Request())
-            print(f"access_tokenaccess_tokenaccess_tokenaccess_tokenaccess_token {credentials.token}")
-            print(f"refresh_tokenrefresh_tokenrefresh_tokenrefresh_tokenrefresh_token {credentials.refresh_token}")
+            # Refresh the credentials; the token endpoint call is blocking
+            await asyncio.to_thread(credentials.refresh, Request())
             # Update the account with new tokens
             update_data = {
                 'access_token': credentials.token,
@@ -251,20 +307,56 @@ class EmailService:
                 'updated_at': datetime.now(timezone.utc).isoformat()
             }
             
-            self.admin.schema(self.email_provider_schema_name).from_(self.email_account_name).update(update_data).eq('id', account_id).execute()
-            print(f"Refreshed tokens for account {account_id}")
+            await self._execute(self.admin.schema(self.email_provider_schema_name).from_(self.email_account_name).update(update_data).eq('id', account_id))
+            logger.info("Refreshed tokens for account %s", account_id)
             
             return {
                 'access_token': credentials.token,
                 'refresh_token': credentials.refresh_token
             }
         except Exception as e:
-            print(f"Failed to refresh tokens: {e}")
+            logger.error("Failed to refresh tokens: %s", e)
             raise ValueError(f"Token refresh failed: {e}")
     
+    def _cached_credentials(self, account: Dict[str, Any]) -> Optional[Credentials]:
+        """Return credentials refreshed here for the account if they are still good"""
+        cached = self._credentials.get(account['id'])
+        if (cached and cached.expiry and cached.refresh_token == account.get('refresh_token')
+                and cached.expiry - datetime.now(timezone.utc).replace(tzinfo=None) > timedelta(seconds=CREDENTIALS_MIN_TTL)):
+            return cached
+        return None
+    
+    async def _refresh_google_credentials(self, account: Dict[str, Any], stale_token: Optional[str]) -> Credentials:
+        """Refresh and save an account's Google token, once for all callers holding stale_token"""
+        # One refresh per account; concurrent callers wait for it and reuse the result
+        async with self._refresh_locks[account['id']]:
+            cached = self._cached_credentials(account)
+            if cached and cached.token != stale_token:
+                return cached
+            
+            credentials = Credentials(
+                token=stale_token,
+                refresh_token=account.get('refresh_token'),
+                token_uri="https://oauth2.googleapis.com/token",
+                client_id=os.getenv("GOOGLE_CLIENT_ID"),
+                client_secret=os.getenv("GOOGLE_CLIENT_SECRET")
+            )
+            logger.info("Token expired for account %s, refreshing...", account['id'])
+            await self._refresh_and_save_tokens(account['id'], account['provider'], credentials)
+            self._credentials[account['id']] = credentials
+            return credentials
+    
     async def _get_credentials_with_refresh(self, account: Dict[str, Any]) -> Any:
         """Get credentials with automatic refresh capability"""
         if account['provider'] == 'google':
+            # Credentials refreshed here know their expiry: reuse them while they are good
+            # (possibly refreshed by a parallel request) and renew them before Gmail rejects them
+            cached = self._credentials.get(account['id'])
+            if cached and cached.expiry and cached.refresh_token == account.get('refresh_token'):
+                return self._cached_credentials(account) or await self._refresh_google_credentials(account, cached.token)
+            
+            # Stored rows carry no expiry, so a token read from one is only known to be
+            # stale once Gmail rejects it; _send_with_account then refreshes and retries
             credentials = Credentials(
                 token=account['access_token'],
                 refresh_token=account.get('refresh_token'),
@@ -272,11 +364,10 @@ class EmailService:
                 client_id=os.getenv("GOOGLE_CLIENT_ID"),
                 client_secret=os.getenv("GOOGLE_CLIENT_SECRET")
             )
-            # Check if token is expired and refresh if needed
+            # Without an expiry this only catches a missing token
             if not credentials.valid:
                 if credentials.expired and credentials.refresh_token:
-                    print(f"Token expired for account {account['id']}, refreshing...")
-                    await self._refresh_and_save_tokens(account['id'], account['provider'], credentials)
+                    return await self._refresh_google_credentials(account, credentials.token)
                 else:
                     raise ValueError("Token expired and no refresh token available")
             
@@ -287,7 +378,7 @@ class EmailService:
 
     async def get_emails(self, user_id: str, lead_id: str, limit: int = 100) -> List[Dict[str, Any]]:
         # Get account details
-        account_result = self.admin.schema(self.email_provider_schema_name).from_(self.email_account_name).select('*').eq('user_id', user_id).execute()
+        account_result = await self._execute(self.admin.schema(self.email_provider_schema_name).from_(self.email_account_name).select('*').eq('user_id', user_id))
         if not account_result.data:
             raise ValueError("Account not found")
         
@@ -296,7 +387,7 @@ class EmailService:
         if account['provider'] not in self.services:
             raise ValueError(f"Unsupported provider: {account['provider']}")
         
-        email_result = self.admin.schema(self.email_schema_name).from_(self.email_message_name).select('*').eq('user_id', user_id).eq('lead_id', lead_id).order('internal_date', desc=True).limit(limit).execute()
+        email_result = await self._execute(self.admin.schema(self.email_schema_name).from_(self.email_message_name).select('*').eq('user_id', user_id).eq('lead_id', lead_id).order('internal_date', desc=True).limit(limit))
         emails = email_result.data
         # Store emails in database
         result = []
@@ -319,7 +410,7 @@ class EmailService:
         return result
 
     async def get_leads(self, user_id: str, limit: int = 100) -> List[Dict[str, Any]]:
-        lead_result = self.admin.schema(self.email_schema_name).from_(self.lead_name).select('*').eq('user_id', user_id).limit(limit).execute()
+        lead_result = await self._execute(self.admin.schema(self.email_schema_name).from_(self.lead_name).select('*').eq('user_id', user_id).limit(limit))
         leads = lead_result.data
         result = [] 
         for lead in leads:
@@ -333,8 +424,13 @@ class EmailService:
         return result
     
     async def send_email(self, user_id: str, account_id: str, to_emails: List[str], subject: str, body: str, is_html: bool = False) -> str:
+        account = await self._get_sending_account(user_id, account_id)
+        return await self._send_with_account(account, to_emails, subject, body, is_html)
+    
+    async def _get_sending_account(self, user_id: str, account_id: str) -> Dict[str, Any]:
+        """Load the user's account with fresh credentials, ready to send from"""
         # Get account details
-        account_result = self.admin.schema(self.email_provider_schema_name).from_(self.email_account_name).select('*').eq('id', account_id).eq('user_id', user_id).execute()
+        account_result = await self._execute(self.admin.schema(self.email_provider_schema_name).from_(self.email_account_name).select('*').eq('id', account_id).eq('user_id', user_id))
         
         if not account_result.data:
             raise ValueError("Account not found")
@@ -346,11 +442,31 @@ class EmailService:
             account['access_token'] = new_credentials.token
             account['refresh_token'] = new_credentials.refresh_token
         
+        return account
+    
+    async def _send_with_account(self, account: Dict[str, Any], to_emails: List[str], subject: str, body: str, is_html: bool = False) -> str:
         # Send email via provider
         if account['provider'] not in self.services:
             raise ValueError(f"Unsupported provider: {account['provider']}")
         
         service = self.services[account['provider']]
+        try:
+            return await service.send_email(
+                account['access_token'],
+                to_emails,
+                subject,
+                body,
+                is_html,
+                account.get('refresh_token')
+            )
+        except httpx.HTTPStatusError as e:
+            if account['provider'] != 'google' or e.response.status_code != 401 or not account.get('refresh_token'):
+                raise
+        
+        # Gmail rejected the token; refresh it through the shared per-account refresh and retry once
+        credentials = await self._refresh_google_credentials(account, account['access_token'])
+        account['access_token'] = credentials.token
+        account['refresh_token'] = credentials.refresh_token
         message_id = await service.send_email(
             account['access_token'],
             to_emails,
@@ -364,41 +480,54 @@ class EmailService:
     
     async def save_draft(self, user_id: str, account_id: str, to_emails: List[str], subject: str, body: str, is_html: bool = False) -> Dict[str, Any]:
         """Save email as draft"""
+        # created_at/updated_at come from the column defaults
         draft_data = {
             'user_id': user_id,
             'account_id': account_id,
             'to': to_emails,
             'subject': subject,
             'body': body,
-            'is_html': is_html,
-            'created_at': datetime.now(timezone.utc).isoformat(),
-            'updated_at': datetime.now(timezone.utc).isoformat()
+            'is_html': is_html
         }
         
-        result = self.admin.schema('email').from_('draft_emails').insert(draft_data).execute()
+        result = await self._execute(self._draft_table().insert(draft_data))
+        self._invalidate_drafts(user_id)
         return result.data[0]
     
     async def get_drafts(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all draft emails for the user"""
-        result = self.admin.schema('email').from_('draft_emails').select('*').eq('user_id', user_id).order('updated_at', desc=True).execute()
+        # Callers get copies, so editing a returned draft cannot corrupt the cache
+        drafts = self._cache_get(self._drafts_cache, user_id)
+        if drafts is not None:
+            return copy.deepcopy(drafts)
+        
+        version = self._draft_version
+        result = await self._execute(self._draft_table().select('*').eq('user_id', user_id).order('updated_at', desc=True))
+        if version == self._draft_version:
+            self._cache_put(self._drafts_cache, user_id, copy.deepcopy(result.data))
         return result.data
     
     async def get_draft(self, user_id: str, draft_id: str) -> Dict[str, Any]:
         """Get a specific draft email"""
-        result = self.admin.schema('email').from_('draft_emails').select('*').eq('id', draft_id).eq('user_id', user_id).execute()
-        
+        draft = self._cache_get(self._draft_cache, (user_id, draft_id))
+        if draft is not None:
+            return copy.deepcopy(draft)
+        
+        version = self._draft_version
+        draft = await self._load_draft(user_id, draft_id)
+        if version == self._draft_version:
+            self._cache_put(self._draft_cache, (user_id, draft_id), copy.deepcopy(draft))
+        return draft
+    
+    async def _load_draft(self, user_id: str, draft_id: str) -> Dict[str, Any]:
+        """Read a draft from the database, bypassing the cache"""
+        result = await self._execute(self._draft_table().select('*').eq('id', draft_id).eq('user_id', user_id))
         if not result.data:
             raise ValueError("Draft not found")
-        
         return result.data[0]
     
     async def update_draft(self, user_id: str, draft_id: str, to_emails: List[str], subject: str, body: str, is_html: bool = False) -> Dict[str, Any]:
         """Update a draft email"""
-        # Check if draft exists and belongs to user
-        existing = self.admin.schema('email').from_('draft_emails').select('*').eq('id', draft_id).eq('user_id', user_id).execute()
-        if not existing.data:
-            raise ValueError("Draft not found")
-        
         # Update draft data
         update_data = {
             'to': to_emails,
@@ -408,40 +537,64 @@ class EmailService:
             'updated_at': datetime.now(timezone.utc).isoformat()
         }
         
-        result = self.admin.schema('email').from_('draft_emails').update(update_data).eq('id', draft_id).eq('user_id', user_id).execute()
+        # The update only matches the user's own draft; no returned row means it does not exist
+        result = await self._execute(self._draft_table().update(update_data).eq('id', draft_id).eq('user_id', user_id))
+        if not result.data:
+            raise ValueError("Draft not found")
+        
+        self._invalidate_drafts(user_id, draft_id)
         return result.data[0]
     
     async def delete_draft(self, user_id: str, draft_id: str) -> bool:
         """Delete a draft email"""
-        # Check if draft exists and belongs to user
-        existing = self.admin.schema('email').from_('draft_emails').select('*').eq('id', draft_id).eq('user_id', user_id).execute()
-        if not existing.data:
+        # Delete returns the removed rows, so an empty result means no such draft
+        result = await self._execute(self._draft_table().delete().eq('id', draft_id).eq('user_id', user_id))
+        if not result.data:
             raise ValueError("Draft not found")
         
-        # Delete draft
-        self.admin.schema('email').from_('draft_emails').delete().eq('id', draft_id).eq('user_id', user_id).execute()
+        self._invalidate_drafts(user_id, draft_id)
         return True
     
     async def send_draft(self, user_id: str, draft_id: str, account_id: str) -> str:
         """Send a draft email"""
-        # Get draft
-        draft_result = self.admin.schema('email').from_('draft_emails').select('*').eq('id', draft_id).eq('user_id', user_id).execute()
-        if not draft_result.data:
-            raise ValueError("Draft not found")
-        
-        draft = draft_result.data[0]
+        # Load the draft and the sending account concurrently; the draft is read
+        # from the database so a cached copy can never be what gets sent
+        draft, account = await asyncio.gather(
+            self._load_draft(user_id, draft_id),
+            self._get_sending_account(user_id, account_id)
+        )
         
         # Send email
-        result = await self.send_email(
-            user_id=user_id,
-            account_id=account_id,
+        result = await self._send_with_account(
+            account,
             to_emails=draft['to'],
             subject=draft['subject'],
             body=draft['body'],
             is_html=draft['is_html']
         )
         
-        # Delete draft after sending
-        self.admin.schema('email').from_('draft_emails').delete().eq('id', draft_id).eq('user_id', user_id).execute()
+        # Delete draft after sending, off the response path
+        self._invalidate_drafts(user_id, draft_id)
+        task = asyncio.create_task(self._delete_sent_draft(user_id, draft_id))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
         
-        return result
\ No newline at end of file
+        return result
+    
+    async def _delete_sent_draft(self, user_id: str, draft_id: str) -> None:
+        """Remove a draft once it has been sent"""
+        try:
+            await self._execute(self._draft_table().delete().eq('id', draft_id).eq('user_id', user_id))
+            self._invalidate_drafts(user_id, draft_id)
+        except Exception as e:
+            logger.error("Failed to delete sent draft %s: %s", draft_id, e)
+
+
+# Global instance, shared so all routers reuse one set of clients and caches
+_email_service: Optional[EmailService] = None
+
+def get_email_service() -> EmailService:
+    global _email_service
+    if _email_service is None:
+        _email_service = EmailService()
+    return _email_service
@@ -1,6 +1,7 @@
 from fastapi import FastAPI, HTTPException, Depends, status, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional, Dict, Any
 import os
@@ -10,7 +11,7 @@ import uvicorn
 from datetime import datetime, timezone
 
 try:
-    from .email_service import EmailService
+    from .email_service import get_email_service
     from .models import (
         SendEmailRequest, SaveDraftRequest, EmailMessageResponse, 
         DraftEmailResponse, LeadResponse
@@ -19,7 +20,7 @@ except ImportError:
     import sys
     import os
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from email_service import EmailService
+    from email_service import get_email_service
     from models import (
         SendEmailRequest, SaveDraftRequest, EmailMessageResponse, 
         DraftEmailResponse, LeadResponse
@@ -30,6 +31,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from auth.auth_routes import get_current_user_from_token
+from common.http_client import close_http_client
 
 service_router = APIRouter(prefix="/email", tags=["email"])
 security = HTTPBearer()
@@ -37,7 +39,7 @@ security = HTTPBearer()
 load_dotenv()
 
 # Initialize email service
-email_service = EmailService()
+email_service = get_email_service()
 
 @service_router.get("/")
 async def root():
@@ -280,7 +282,8 @@ async def save_draft(
 email_app = FastAPI(
     title="Email Service API",
     description="API for managing emails and drafts with Supabase",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -291,7 +294,12 @@ email_app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+@email_app.on_event("shutdown")
+async def close_shared_clients():
+    await close_http_client()
+
 email_app.include_router(service_router)
 
 if __name__ == "__main__":
-    uvicorn.run(email_app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    uvicorn.run(email_app, host="0.0.0.0", port=8001, loop="uvloop", http="httptools")
\ No newline at end of file
@@ -13,7 +13,7 @@ from .openai_service import OpenAIService, get_openai_service
 try:
     from ..auth.auth_routes import get_current_user_from_token
     from ..auth.models import UserResponse
-    from ..email_service.email_service import EmailService
+    from ..email_service.email_service import get_email_service
 except ImportError:
     # Handle relative import issues
     import sys
@@ -21,13 +21,13 @@ except ImportError:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from auth.auth_routes import get_current_user_from_token
     from auth.models import UserResponse
-    from email_service.email_service import EmailService
+    from email_service.email_service import get_email_service
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-email_service = EmailService()
+email_service = get_email_service()
 # Create router
 llm_router = APIRouter(prefix="/llm", tags=["LLM"])
 
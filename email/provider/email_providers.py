@@ -1,66 +1,87 @@
 import os
+import logging
+import asyncio
 import base64
 import json
+import time
 import uuid
+from functools import lru_cache
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any, Optional
-import httpx
+from typing import List, Dict, Any, Optional, Tuple
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from msal import ConfidentialClientApplication
 import requests
 from email.mime.text import MIMEText
+from email.utils import parsedate_to_datetime
 from email.mime.multipart import MIMEMultipart
 import imaplib
 import smtplib
 
 try:
     from common.supabase_client import get_supabase_client
+    from common.http_client import get_http_client
 except ImportError:
     import sys
     import os
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from common.supabase_client import get_supabase_client
+    from common.http_client import get_http_client
 
+logger = logging.getLogger(__name__)
+
+
+# Requests per Gmail batch; Gmail accepts 100 but rate-limits batches above 50
+GMAIL_BATCH_LIMIT = 50
+# Retries for batched message fetches that fail (e.g. 429 rateLimitExceeded)
+GMAIL_FETCH_MAX_RETRIES = 3
+GMAIL_FETCH_BACKOFF = 1
+# Gmail history record types that change what is cached for a message
+GMAIL_HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+# Partial response for messages.get: only what _fetch_emails reads (size keeps 'body' present when data is absent)
+GMAIL_MESSAGE_FIELDS = 'id,labelIds,payload(mimeType,headers(name,value),body(size,data),parts(mimeType,body(size,data)))'
+
+OUTLOOK_DELTA_URL = "https://graph.microsoft.com/v1.0/me/mailFolders/inbox/messages/delta"
+OUTLOOK_DELTA_SELECT = 'subject,from,toRecipients,body,receivedDateTime,isRead'
+OUTLOOK_DELTA_PAGE_SIZE = 100
+# Days of mail the first Outlook delta round seeds the cache with
+OUTLOOK_DELTA_SEED_DAYS = 30
+
+# email_sync_state key for the cursor kept by EmailProviderManager.get_emails
+PROVIDER_SYNC_FOLDER = 'provider_messages'
+# Seconds a user's account list is served from memory
+ACCOUNTS_CACHE_TTL = 60
 
 
 def _parse_email_timestamp(timestamp_str: str) -> str:
     """Parse email timestamp from various formats to ISO 8601"""
-    if not timestamp_str:
-        return datetime.now().isoformat()
+    # Unparseable input maps to the current time, which must stay outside the cache
+    if timestamp_str:
+        parsed = _parse_known_timestamp(timestamp_str)
+        if parsed:
+            return parsed
+    return datetime.now().isoformat()
+
+
+@lru_cache(maxsize=4096)
+def _parse_known_timestamp(timestamp_str: str) -> Optional[str]:
+    """ISO 8601 form of a parseable timestamp, or None; repeat syncs hit the cache"""
+    # API timestamps are ISO 8601, which fromisoformat parses without trial and error
+    try:
+        return datetime.fromisoformat(timestamp_str.replace('Z', '+00:00')).isoformat()
+    except ValueError:
+        pass
     
+    # Date headers are RFC 2822, sometimes with a trailing "(UTC)" comment
     try:
-        # Try parsing RFC 2822 format (Gmail format)
-        # "Thu, 18 Sep 2025 16:00:51 +0000 (UTC)"
-        if '(' in timestamp_str and ')' in timestamp_str:
-            # Remove timezone info in parentheses
-            clean_timestamp = timestamp_str.split('(')[0].strip()
-            dt = datetime.strptime(clean_timestamp, '%a, %d %b %Y %H:%M:%S %z')
-            return dt.isoformat()
-        
-        # Try other common formats
-        formats = [
-            '%a, %d %b %Y %H:%M:%S %z',  # RFC 2822
-            '%Y-%m-%d %H:%M:%S',         # Simple format
-            '%Y-%m-%dT%H:%M:%S',         # ISO without timezone
-            '%Y-%m-%dT%H:%M:%SZ',        # ISO with Z
-            '%Y-%m-%dT%H:%M:%S.%fZ',     # ISO with microseconds
-        ]
-        
-        for fmt in formats:
-            try:
-                dt = datetime.strptime(timestamp_str, fmt)
-                return dt.isoformat()
-            except ValueError:
-                continue
-                
-        # If all parsing fails, return current time
-        return datetime.now().isoformat()
-        
-    except Exception:
-        return datetime.now().isoformat()
+        return parsedate_to_datetime(timestamp_str.partition('(')[0].rstrip()).isoformat()
+    except (TypeError, ValueError):
+        pass
+    
+    return None
 
 
 class GoogleEmailProvider:
@@ -79,7 +100,6 @@ class GoogleEmailProvider:
         ]
     
     def get_auth_url(self, state: str) -> str:
-        print(f"Getting auth URL for Google")
         flow = Flow.from_client_config(
             {
                 "web": {
@@ -93,14 +113,12 @@ class GoogleEmailProvider:
             scopes=self.scopes
         )
         flow.redirect_uri = self.redirect_uri
-        print(f"Redirect URI: {self.redirect_uri}")
         auth_url, _ = flow.authorization_url(
             access_type='offline',
             prompt='consent',
             include_granted_scopes='true',
             state=state
         )
-        print(f"Auth URL: {auth_url}")
         return auth_url
     
     async def exchange_code_for_tokens(self, code: str) -> Dict[str, str]:
@@ -116,25 +134,20 @@ class GoogleEmailProvider:
             },
             scopes=self.scopes
         )
-        print(f"Flow: {flow}")
         flow.redirect_uri = self.redirect_uri
-        print(f"Redirect URI: {self.redirect_uri}")
-        print(f"Code: {code}")
         try:
             flow.fetch_token(code=code)
         except Exception as e:
-            print(f"Error: {e}")
+            logger.error("Google token exchange failed: %s", e)
             # Add more context for debugging token exchange failures
             raise RuntimeError(f"Failed to exchange code for tokens: {e}")
-        print(f"code: {code}")
         credentials = flow.credentials
-        print(f"Credentials: {credentials}")
         return {
             "access_token": credentials.token,
             "refresh_token": credentials.refresh_token
         }
     
-    async def get_emails(self, access_token: str, limit: int = 50, refresh_token: str = None) -> List[Dict[str, Any]]:
+    def _build_service(self, access_token: str, refresh_token: str = None):
         credentials = Credentials(
             token=access_token,
             refresh_token=refresh_token,
@@ -142,15 +155,98 @@ class GoogleEmailProvider:
             client_id=self.client_id,
             client_secret=self.client_secret
         )
-        service = build('gmail', 'v1', credentials=credentials)
+        return build('gmail', 'v1', credentials=credentials)
+    
+    async def get_emails(self, access_token: str, limit: int = 50, refresh_token: str = None) -> List[Dict[str, Any]]:
+        # The Gmail client blocks, so the whole list-and-fetch sequence runs in a worker thread
+        return await asyncio.to_thread(self._list_emails, access_token, limit, refresh_token)
+    
+    def _list_emails(self, access_token: str, limit: int, refresh_token: Optional[str]) -> List[Dict[str, Any]]:
+        service = self._build_service(access_token, refresh_token)
         
         # Get list of messages
         results = service.users().messages().list(userId='me', maxResults=limit).execute()
-        messages = results.get('messages', [])
+        return self._fetch_emails(service, [message['id'] for message in results.get('messages', [])])
+    
+    async def sync_emails(self, access_token: str, limit: int = 50, refresh_token: str = None, cursor: str = None) -> Tuple[List[Dict[str, Any]], List[str], Optional[str]]:
+        """Return messages changed and removed since cursor (a Gmail history ID), and the next cursor"""
+        return await asyncio.to_thread(self._sync_emails, access_token, limit, refresh_token, cursor)
+    
+    def _sync_emails(self, access_token: str, limit: int, refresh_token: Optional[str], cursor: Optional[str]) -> Tuple[List[Dict[str, Any]], List[str], Optional[str]]:
+        """Blocking body of sync_emails"""
+        service = self._build_service(access_token, refresh_token)
+        
+        if cursor:
+            try:
+                changed, removed, history_id = self._history_changes(service, cursor)
+                return self._fetch_emails(service, changed), removed, history_id
+            except HttpError as e:
+                # 404 means the history ID is too old; resync from a full list
+                if e.resp.status != 404:
+                    raise
+        
+        # Take the history ID before listing so no change falls between the two
+        history_id = service.users().getProfile(userId='me').execute()['historyId']
+        results = service.users().messages().list(userId='me', maxResults=limit).execute()
+        return self._fetch_emails(service, [message['id'] for message in results.get('messages', [])]), [], history_id
+    
+    def _history_changes(self, service, start_history_id: str) -> Tuple[List[str], List[str], str]:
+        """Collect IDs of messages changed and deleted since start_history_id"""
+        changed, removed = set(), set()
+        page_token = None
+        while True:
+            response = service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=GMAIL_HISTORY_TYPES,
+                pageToken=page_token
+            ).execute()
+            for record in response.get('history', []):
+                for key in ('messagesAdded', 'labelsAdded', 'labelsRemoved'):
+                    changed.update(item['message']['id'] for item in record.get(key, []))
+                removed.update(item['message']['id'] for item in record.get('messagesDeleted', []))
+            
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return list(changed - removed), list(removed), response['historyId']
+    
+    def _fetch_emails(self, service, message_ids: List[str]) -> List[Dict[str, Any]]:
+        """Fetch and convert messages, batched to cut HTTP round trips
+        
+        Blocking; failed sub-requests are retried with backoff, and a ValueError is raised if any still fail
+        so callers do not advance their sync cursor past messages that were never fetched.
+        """
+        fetched = {}
+        failed = {}
+        def on_message(request_id, response, exception):
+            if exception is None:
+                fetched[request_id] = response
+            elif not (isinstance(exception, HttpError) and exception.resp.status == 404):
+                # A 404 means the message was deleted after it was listed; there is nothing to fetch
+                failed[request_id] = exception
+        
+        pending = message_ids
+        for attempt in range(GMAIL_FETCH_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(GMAIL_FETCH_BACKOFF * 2 ** (attempt - 1))
+            failed.clear()
+            for start in range(0, len(pending), GMAIL_BATCH_LIMIT):
+                batch = service.new_batch_http_request(callback=on_message)
+                for message_id in pending[start:start + GMAIL_BATCH_LIMIT]:
+                    batch.add(service.users().messages().get(userId='me', id=message_id, fields=GMAIL_MESSAGE_FIELDS), request_id=message_id)
+                batch.execute()
+            pending = list(failed)
+            if not pending:
+                break
+            if attempt == GMAIL_FETCH_MAX_RETRIES:
+                raise ValueError(f"Failed to fetch {len(pending)} Gmail messages: {failed[pending[0]]}")
+            logger.warning("Fetching %d Gmail messages failed, retrying: %s", len(pending), failed[pending[0]])
         
         emails = []
-        for message in messages:
-            msg = service.users().messages().get(userId='me', id=message['id']).execute()
+        for message_id in message_ids:
+            msg = fetched.get(message_id)
+            if msg is None:
+                continue
             
             # Extract headers
             headers = msg['payload'].get('headers', [])
@@ -163,7 +259,7 @@ class GoogleEmailProvider:
             body = self._extract_body(msg['payload'])
             
             emails.append({
-                'id': message['id'],
+                'id': message_id,
                 'subject': subject,
                 'sender': sender,
                 'recipient': recipient,
@@ -194,14 +290,10 @@ class GoogleEmailProvider:
         return body
     
     async def send_email(self, access_token: str, to_emails: List[str], subject: str, body: str, is_html: bool = False, refresh_token: str = None) -> str:
-        credentials = Credentials(
-            token=access_token,
-            refresh_token=refresh_token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=self.client_id,
-            client_secret=self.client_secret
-        )
-        service = build('gmail', 'v1', credentials=credentials)
+        return await asyncio.to_thread(self._send_email, access_token, to_emails, subject, body, is_html, refresh_token)
+    
+    def _send_email(self, access_token: str, to_emails: List[str], subject: str, body: str, is_html: bool, refresh_token: Optional[str]) -> str:
+        service = self._build_service(access_token, refresh_token)
         
         # Create message
         message = MIMEText(body, 'html' if is_html else 'plain')
@@ -243,54 +335,81 @@ class OutlookEmailProvider:
         return auth_url
     
     async def exchange_code_for_tokens(self, code: str) -> Dict[str, str]:
-        print(f"Exchanging code for tokens: {code}")
-        print(f"Client ID: {self.client_id}")
-        print(f"Client Secret: {self.client_secret}")
-        print(f"Redirect URI: {self.redirect_uri}")
-        print(f"Scopes: {self.scopes}") 
         app = ConfidentialClientApplication(
             self.client_id,
             authority=self.authority,
             client_credential=self.client_secret
         )
-        print(f"App: {app}")
         result = app.acquire_token_by_authorization_code(
             code,
             scopes=self.scopes,
             redirect_uri=self.redirect_uri
         )
-        print(f"Result: {result}")
         return {
             "access_token": result["access_token"],
             "refresh_token": result.get("refresh_token", "")
         }
     
-    async def get_emails(self, access_token: str, limit: int = 50) -> List[Dict[str, Any]]:
+    async def get_emails(self, access_token: str, limit: int = 50, refresh_token: str = None) -> List[Dict[str, Any]]:
         headers = {
             'Authorization': f'Bearer {access_token}',
             'Content-Type': 'application/json'
         }
         
-        url = f"https://graph.microsoft.com/v1.0/me/messages?$top={limit}&$orderby=receivedDateTime desc"
+        url = "https://graph.microsoft.com/v1.0/me/messages"
+        params = {'$top': limit, '$orderby': 'receivedDateTime desc'}
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
+        client = get_http_client()
+        response = await client.get(url, headers=headers, params=params)
+        response.raise_for_status()
+        data = response.json()
         
-        emails = []
-        for message in data.get('value', []):
-            emails.append({
-                'id': message['id'],
-                'subject': message.get('subject', 'No Subject'),
-                'sender': message['from']['emailAddress']['address'],
-                'recipient': message['toRecipients'][0]['emailAddress']['address'] if message.get('toRecipients') else '',
-                'body': message.get('body', {}).get('content', ''),
-                'timestamp': message['receivedDateTime'],
-                'is_read': message.get('isRead', False)
-            })
+        return [self._to_email(message) for message in data.get('value', [])]
+    
+    async def sync_emails(self, access_token: str, limit: int = 50, refresh_token: str = None, cursor: str = None) -> Tuple[List[Dict[str, Any]], List[str], Optional[str]]:
+        """Return inbox messages changed and removed since cursor (a Graph deltaLink), and the next cursor"""
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Prefer': f'odata.maxpagesize={OUTLOOK_DELTA_PAGE_SIZE}'
+        }
         
-        return emails
+        if cursor:
+            url, params = cursor, None
+        else:
+            # Delta only accepts a receivedDateTime filter, so the first round seeds recent mail
+            since = (datetime.now(timezone.utc) - timedelta(days=OUTLOOK_DELTA_SEED_DAYS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+            url, params = OUTLOOK_DELTA_URL, {'$select': OUTLOOK_DELTA_SELECT, '$filter': f'receivedDateTime ge {since}'}
+        
+        changed, removed = [], []
+        client = get_http_client()
+        while True:
+            response = await client.get(url, headers=headers, params=params)
+            if response.status_code == 410 and cursor:
+                # The delta link expired; start a new round
+                return await self.sync_emails(access_token, limit, refresh_token)
+            response.raise_for_status()
+            data = response.json()
+                
+            for message in data.get('value', []):
+                if '@removed' in message:
+                    removed.append(message['id'])
+                else:
+                    changed.append(self._to_email(message))
+                
+            if '@odata.nextLink' not in data:
+                return changed, removed, data.get('@odata.deltaLink')
+            url, params = data['@odata.nextLink'], None
+    
+    def _to_email(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'id': message['id'],
+            'subject': message.get('subject', 'No Subject'),
+            'sender': message['from']['emailAddress']['address'],
+            'recipient': message['toRecipients'][0]['emailAddress']['address'] if message.get('toRecipients') else '',
+            'body': message.get('body', {}).get('content', ''),
+            'timestamp': message['receivedDateTime'],
+            'is_read': message.get('isRead', False)
+        }
     
     async def send_email(self, access_token: str, to_emails: List[str], subject: str, body: str, is_html: bool = False) -> str:
         headers = {
@@ -313,9 +432,9 @@ class OutlookEmailProvider:
         
         url = "https://graph.microsoft.com/v1.0/me/sendMail"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=message)
-            response.raise_for_status()
+        client = get_http_client()
+        response = await client.post(url, headers=headers, json=message)
+        response.raise_for_status()
         
         return "sent"  # Microsoft Graph doesn't return a message ID for sendMail
 
@@ -347,20 +466,20 @@ class YahooEmailProvider:
             'code': code
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                'https://api.login.yahoo.com/oauth2/get_token',
-                data=data
-            )
-            response.raise_for_status()
-            result = response.json()
+        client = get_http_client()
+        response = await client.post(
+            'https://api.login.yahoo.com/oauth2/get_token',
+            data=data
+        )
+        response.raise_for_status()
+        result = response.json()
         
         return {
             "access_token": result["access_token"],
             "refresh_token": result.get("refresh_token", "")
         }
     
-    async def get_emails(self, access_token: str, limit: int = 50) -> List[Dict[str, Any]]:
+    async def get_emails(self, access_token: str, limit: int = 50, refresh_token: str = None) -> List[Dict[str, Any]]:
         # Yahoo Mail API is more complex and requires additional steps
         # This is a simplified implementation
         headers = {
@@ -372,6 +491,10 @@ class YahooEmailProvider:
         # This is a placeholder implementation
         return []
     
+    async def sync_emails(self, access_token: str, limit: int = 50, refresh_token: str = None, cursor: str = None) -> Tuple[List[Dict[str, Any]], List[str], Optional[str]]:
+        # No incremental API; every sync is a full list
+        return await self.get_emails(access_token, limit, refresh_token), [], None
+    
     async def send_email(self, access_token: str, to_emails: List[str], subject: str, body: str, is_html: bool = False) -> str:
         # Yahoo Mail API for sending emails is complex and may not be available
         # This is a placeholder implementation
@@ -386,7 +509,18 @@ class EmailProviderManager:
         }
         # self.admin = get_supabase_client().get_client()
         self.admin = get_supabase_client().get_admin_client()
-        
+        # user_id -> (fetched_at, accounts); dropped whenever an account row is written
+        self._accounts_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+    
+    async def _execute(self, query) -> Any:
+        """Run a blocking Supabase query in a worker thread"""
+        # schema() switches the profile on the shared session; pin it to this query
+        # now so another query built before this one runs cannot redirect it
+        profile = query.session.headers.get('Accept-Profile')
+        if profile:
+            query.headers['Accept-Profile'] = profile
+            query.headers['Content-Profile'] = profile
+        return await asyncio.to_thread(query.execute)
     
     def _normalize_user_id(self, user_id) -> str:
         try:
@@ -404,12 +538,10 @@ class EmailProviderManager:
         
         # Generate state for OAuth
         state = str(uuid.uuid4())
-        print(f"State: {state}")
         
         # Store state in database with user_id
         normalized_user_id = self._normalize_user_id(user_id)
         await self._store_oauth_state(state, provider, normalized_user_id)
-        print(f"Storing state in database with user_id {normalized_user_id}")
         return self.providers[provider].get_auth_url(state)
     
     async def handle_oauth_callback(self, user_id: str, provider: str, code: str) -> Dict[str, Any]:
@@ -418,8 +550,6 @@ class EmailProviderManager:
         
         # Exchange code for tokens
         tokens = await self.providers[provider].exchange_code_for_tokens(code)
-        print("tokens tokens tokens tokens tokens" )
-        print(tokens)
         
         # Get user email from provider
         user_email = await self._get_user_email_from_provider(provider, tokens['access_token'])
@@ -443,19 +573,38 @@ class EmailProviderManager:
             'is_active': True
         }
         
-        result = self.admin.schema('email_provider').from_('email_accounts').upsert(account_data, on_conflict="user_id,email,provider").execute()
+        result = await self._execute(self.admin.schema('email_provider').from_('email_accounts').upsert(account_data, on_conflict="user_id,email,provider"))
+        self._accounts_cache.pop(user_id, None)
         return result.data[0]
     
     async def get_user_email_accounts(self, user_id: str) -> List[Dict[str, Any]]:
-        result = self.admin.schema('email_provider').from_('email_accounts').select('*').eq('user_id', user_id).execute()
+        cached = self._accounts_cache.get(user_id)
+        if cached and time.monotonic() - cached[0] < ACCOUNTS_CACHE_TTL:
+            return cached[1]
+        
+        result = await self._execute(self.admin.schema('email_provider').from_('email_accounts').select('*').eq('user_id', user_id))
+        self._accounts_cache[user_id] = (time.monotonic(), result.data)
         return result.data
     
+    async def get_user_email_account(self, user_id: str, account_id: str) -> Dict[str, Any]:
+        """Look up one of the user's accounts by primary key, with fresh credentials"""
+        account_result = await self._execute(self.admin.schema('email_provider').from_('email_accounts').select('*').eq('id', account_id).eq('user_id', user_id))
+        if not account_result.data:
+            raise ValueError("Account not found")
+        
+        account = account_result.data[0]
+        new_credentials = await self._get_credentials_with_refresh(account)
+        if new_credentials:
+            account['access_token'] = new_credentials.token
+            account['refresh_token'] = new_credentials.refresh_token
+        return account
+    
 
     async def _refresh_and_save_tokens(self, account_id: str, provider_name: str, credentials) -> Dict[str, str]:
         """Refresh tokens and save to database"""
         try:
-            # Refresh the credentials
-            credentials.refresh(Request())
+            # Refresh the credentials; the token endpoint call is blocking
+            await asyncio.to_thread(credentials.refresh, Request())
             
             # Update the account with new tokens
             update_data = {
@@ -464,15 +613,17 @@ class EmailProviderManager:
                 'updated_at': datetime.now(timezone.utc).isoformat()
             }
             
-            self.admin.schema('email_provider').from_('email_accounts').update(update_data).eq('id', account_id).execute()
-            print(f"Refreshed tokens for account {account_id}")
+            await self._execute(self.admin.schema('email_provider').from_('email_accounts').update(update_data).eq('id', account_id))
+            # Cached account lists hold the old tokens; refreshes are rare, so drop them all
+            self._accounts_cache.clear()
+            logger.info("Refreshed tokens for account %s", account_id)
             
             return {
                 'access_token': credentials.token,
                 'refresh_token': credentials.refresh_token
             }
         except Exception as e:
-            print(f"Failed to refresh tokens: {e}")
+            logger.error("Failed to refresh tokens: %s", e)
             raise ValueError(f"Token refresh failed: {e}")
     
     async def _get_credentials_with_refresh(self, account: Dict[str, Any]) -> Any:
@@ -480,9 +631,6 @@ class EmailProviderManager:
         provider = self.providers[account['provider']]
         
         if account['provider'] == 'google':
-            from google.oauth2.credentials import Credentials
-            from google.auth.transport.requests import Request
-            
             credentials = Credentials(
                 token=account['access_token'],
                 refresh_token=account.get('refresh_token'),
@@ -494,7 +642,7 @@ class EmailProviderManager:
             # Check if token is expired and refresh if needed
             if not credentials.valid:
                 if credentials.expired and credentials.refresh_token:
-                    print(f"Token expired for account {account['id']}, refreshing...")
+                    logger.info("Token expired for account %s, refreshing...", account['id'])
                     await self._refresh_and_save_tokens(account['id'], account['provider'], credentials)
                 else:
                     raise ValueError("Token expired and no refresh token available")
@@ -504,62 +652,64 @@ class EmailProviderManager:
             # For other providers, return the access token as-is
             return None
 
-    async def get_emails(self, user_id: str, account_id: str, limit: int = 50) -> List[Dict[str, Any]]:
-        # Get account details
-        account_result = self.admin.schema('email_provider').from_('email_accounts').select('*').eq('id', account_id).eq('user_id', user_id).execute()
-        print(f"account_result {account_result}")
-        if not account_result.data:
-            raise ValueError("Account not found")
-        
-        account = account_result.data[0]
-        new_credentials = await self._get_credentials_with_refresh(account)
-        print("new_credentialsnew_credentialsnew_credentialsnew_credentialsnew_credentials")
-        print(account)
-        if new_credentials:
-            account['access_token'] = new_credentials.token
-            account['refresh_token'] = new_credentials.refresh_token
-        print("accountaccountaccountaccountaccountaccount")
-        print(account)
+    async def get_emails(self, user_id: str, account_id: str, limit: int = 50, unread_only: bool = False, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        account = await self.get_user_email_account(user_id, account_id)
         
         provider = self.providers[account['provider']]
-        # Get emails from provider
-        print(f"account['access_token'] :{account['access_token']}")
-        emails = await provider.get_emails(account['access_token'], limit, account.get('refresh_token'))
-        print(f"account['access_token'] :")
-        
-        # Store emails in database
-        for email in emails:
-            email_data = {
+        # Pull only what changed since the stored cursor, falling back to a full list
+        state = await self._execute(self.admin.schema('email').from_('email_sync_state').select('delta_link').eq('account_id', account_id).eq('folder', PROVIDER_SYNC_FOLDER).limit(1))
+        cursor = state.data[0]['delta_link'] if state.data else None
+        changed, removed, cursor = await provider.sync_emails(account['access_token'], limit, account.get('refresh_token'), cursor)
+        
+        # Merge the changes into the stored emails
+        if changed:
+            rows = [
+                {
+                    'account_id': account_id,
+                    'message_id': email['id'],
+                    'subject': email['subject'],
+                    'sender': email['sender'],
+                    'recipient': email['recipient'],
+                    'body': email['body'],
+                    'timestamp': email['timestamp'],
+                    'is_read': email['is_read']
+                }
+                for email in changed
+            ]
+            await self._execute(self.admin.schema('email').from_('email_messages').upsert(rows, on_conflict='account_id,message_id'))
+        if removed:
+            await self._execute(self.admin.schema('email').from_('email_messages').delete().eq('account_id', account_id).in_('message_id', removed))
+        if cursor:
+            await self._execute(self.admin.schema('email').from_('email_sync_state').upsert({
                 'account_id': account_id,
-                'message_id': email['id'],
-                'subject': email['subject'],
-                'sender': email['sender'],
-                'recipient': email['recipient'],
-                'body': email['body'],
-                'timestamp': email['timestamp'],
-                'is_read': email['is_read']
+                'folder': PROVIDER_SYNC_FOLDER,
+                'delta_link': cursor,
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }))
+        
+        # Serve the newest emails from the local store, filtered in Postgres
+        query = self.admin.schema('email').from_('email_messages').select('*').eq('account_id', account_id)
+        if unread_only:
+            query = query.eq('is_read', False)
+        if since:
+            query = query.gte('timestamp', since.isoformat())
+        result = await self._execute(query.order('timestamp', desc=True).limit(limit))
+        return [
+            {
+                'id': row['message_id'],
+                'subject': row['subject'],
+                'sender': row['sender'],
+                'recipient': row['recipient'],
+                'body': row['body'],
+                'timestamp': row['timestamp'],
+                'is_read': row['is_read']
             }
-            email_message = self.admin.schema('email').from_('email_messages').select('*').eq('account_id', account_id).eq('message_id', email['id']).limit(1).execute()
-            if not email_message.data:
-                self.admin.schema('email').from_('email_messages').upsert(email_data).execute()
-            else:
-                print("message already exist {email_message}")
-        
-        return emails
+            for row in result.data
+        ]
     
     async def send_email(self, user_id: str, account_id: str, to_emails: List[str], subject: str, body: str, is_html: bool = False) -> str:
-        # Get account details
-        account_result = self.admin.schema('email_provider').from_('email_accounts').select('*').eq('id', account_id).eq('user_id', user_id).execute()
-        
-        if not account_result.data:
-            raise ValueError("Account not found")
-        
-        account = account_result.data[0]
+        account = await self.get_user_email_account(user_id, account_id)
         provider = self.providers[account['provider']]
-        new_credentials = await self._get_credentials_with_refresh(account)
-        if new_credentials:
-            account['access_token'] = new_credentials.token
-            account['refresh_token'] = new_credentials.refresh_token
         
         # Send email via provider
         message_id = await provider.send_email(
@@ -581,47 +731,44 @@ class EmailProviderManager:
             'user_id': user_id,
             'expires_at': (datetime.now(timezone.utc) + timedelta(minutes=10)).isoformat()
         }
-        print(f"Storing state in database: {state_data}")
         try:    
-            self.admin.schema('email_provider').from_('oauth_states').insert(state_data).execute()
-            print(f"State stored in database")
+            await self._execute(self.admin.schema('email_provider').from_('oauth_states').insert(state_data))
         except Exception as e:
-            print(f"Error storing state in database: {e}")
+            logger.error("Error storing OAuth state in database: %s", e)
     
     async def _get_user_email_from_provider(self, provider: str, access_token: str) -> str:
         if provider == 'google':
             # Use Google API to get user info
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"https://www.googleapis.com/oauth2/v2/userinfo?access_token={access_token}"
-                )
-                response.raise_for_status()
-                data = response.json()
-                return data['email']
+            client = get_http_client()
+            response = await client.get(
+                f"https://www.googleapis.com/oauth2/v2/userinfo?access_token={access_token}"
+            )
+            response.raise_for_status()
+            data = response.json()
+            return data['email']
         elif provider == 'outlook':
             # Use Microsoft Graph to get user info
             headers = {'Authorization': f'Bearer {access_token}'}
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    "https://graph.microsoft.com/v1.0/me",
-                    headers=headers
-                )
-                response.raise_for_status()
-                data = response.json()
-                return data['mail']
+            client = get_http_client()
+            response = await client.get(
+                "https://graph.microsoft.com/v1.0/me",
+                headers=headers
+            )
+            response.raise_for_status()
+            data = response.json()
+            return data['mail']
         else:
             # For Yahoo, this would need to be implemented based on their API
             return "user@yahoo.com"  # Placeholder
     
     async def validate_and_consume_state(self, state: str, provider: str) -> str:
         """Validate the OAuth state and return the associated user_id. Persist verification metadata instead of deleting."""
-        print("validate_and_consume_statevalidate_and_consume_statevalidate_and_consume_state 00000000000")
         # Find matching state
-        result = self.admin.schema('email_provider').from_('oauth_states').select('*').eq('state', state).eq('provider', provider).limit(1).execute()
+        result = await self._execute(self.admin.schema('email_provider').from_('oauth_states').select('*').eq('state', state).eq('provider', provider).limit(1))
         if not result.data:
             raise ValueError("Invalid OAuth state")
         record = result.data[0]
-        print("validate_and_consume_statevalidate_and_consume_statevalidate_and_consume_state 1111111")# Check expiry
+        # Check expiry
         try:
             expires_at = datetime.fromisoformat(record['expires_at'])
             if expires_at.tzinfo is None:
@@ -636,11 +783,19 @@ class EmailProviderManager:
         user_id = record.get('user_id')
         if not user_id:
             raise ValueError("OAuth state is missing user association")
-        print("validate_and_consume_statevalidate_and_consume_statevalidate_and_consume_state 222222222")
         # Mark as verified instead of deleting
-        self.admin.schema('email_provider').from_('oauth_states').update({
+        await self._execute(self.admin.schema('email_provider').from_('oauth_states').update({
             'verified': True,
             'verified_at': now_utc.isoformat()
-        }).eq('id', record['id']).execute()
-        print("validate_and_consume_statevalidate_and_consume_statevalidate_and_consume_state 3333333333")
+        }).eq('id', record['id']))
         return user_id
+
+
+# Global instance, shared so every caller reuses the same provider clients
+_email_provider_manager: Optional[EmailProviderManager] = None
+
+def get_email_provider_manager() -> EmailProviderManager:
+    global _email_provider_manager
+    if _email_provider_manager is None:
+        _email_provider_manager = EmailProviderManager()
+    return _email_provider_manager
@@ -1,6 +1,7 @@
 from fastapi import FastAPI, HTTPException, Depends, status, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional, Dict, Any
 import os
@@ -10,14 +11,14 @@ import uvicorn
 
 try:
     from common.supabase_client import get_supabase_client
-    from .email_providers import EmailProviderManager
+    from .email_providers import get_email_provider_manager
     from .models import User, EmailAccount
 except ImportError:
     import sys
     import os
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from common.supabase_client import get_supabase_client
-    from email_providers import EmailProviderManager
+    from email_providers import get_email_provider_manager
     from models import User, EmailAccount
 
 # Import auth module from parent directory
@@ -25,6 +26,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from auth.auth_routes import get_current_user_from_token
+from common.http_client import close_http_client
 
 provider_router = APIRouter(prefix="/auth", tags=["provider"])
 security = HTTPBearer()
@@ -33,7 +35,7 @@ load_dotenv()
 
 
 # Initialize email provider manager
-email_manager = EmailProviderManager()
+email_manager = get_email_provider_manager()
 
 # Pydantic models for API
 class UserRegistration(BaseModel):
@@ -157,7 +159,8 @@ async def oauth_callback(
 provider_app = FastAPI(
     title="Email Provider API",
     description="API for managing email providers (Google, Outlook, Yahoo) with Supabase",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -168,7 +171,12 @@ provider_app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+@provider_app.on_event("shutdown")
+async def close_shared_clients():
+    await close_http_client()
+
 provider_app.include_router(provider_router)
 
 if __name__ == "__main__":
-    uvicorn.run(provider_app, host="0.0.0.0", port=8000)
+    uvicorn.run(provider_app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
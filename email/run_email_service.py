@@ -11,6 +11,7 @@ from pathlib import Path
 from fastapi import FastAPI, HTTPException, Depends, status, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import ORJSONResponse
 import uvicorn
 try:
     from .email_service.service_routes import service_router
@@ -18,6 +19,7 @@ try:
     from .auth.auth_routes import auth_router
     from .data_sync.data_sync_routes import data_sync_router
     from .llm.llm_routes import llm_router
+    from .common.http_client import close_http_client
 except ImportError:
     import sys
     import os
@@ -27,6 +29,7 @@ except ImportError:
     from auth.auth_routes import auth_router
     from data_sync.data_sync_routes import data_sync_router
     from llm.llm_routes import llm_router
+    from common.http_client import close_http_client
 # Add the current directory to Python path
 current_dir = Path(__file__).parent
 sys.path.insert(0, str(current_dir))
@@ -35,7 +38,8 @@ sys.path.insert(0, str(current_dir))
 app = FastAPI(
     title="Email Provider API",
     description="API for managing email providers (Google, Outlook, Yahoo) with Supabase",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -46,6 +50,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+@app.on_event("shutdown")
+async def close_shared_clients():
+    await close_http_client()
+
 app.include_router(provider_router)
 app.include_router(auth_router)
 app.include_router(service_router)
@@ -54,4 +63,4 @@ app.include_router(llm_router)
 
 # Import and run the FastAPI app
 if __name__ == "__main__":
-       uvicorn.run(app, host="0.0.0.0", port=8000)
+       uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")